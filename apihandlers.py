@@ -4,10 +4,16 @@
 import asyncio
 import json
 import os
+import random
+import time
+import weakref
+from bisect import bisect_left
 from collections import deque
+from contextlib import nullcontext
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from zoneinfo import ZoneInfo
 
-import aiofiles
-import arrow
 import structlog
 import ujson
 import aiohttp
@@ -15,18 +21,387 @@ import aiohttp
 from yarl import URL
 
 
+def _arrow():
+    # arrow behövs bara av de handlers som tolkar sina egna datumformat, importeras först när någon av dem loggar in
+    import arrow
+    return arrow
+
+
+class NetworkState:
+    log = structlog.get_logger(__name__)
+
+    PROBE_URL = "http://google.com"
+
+    def __init__(self, ttl=60, probeInterval=30, probeTimeout=10, probeUrl=None):
+        self.ttl = ttl
+        self.probeInterval = probeInterval
+        self.probeTimeout = probeTimeout
+        self.probeUrl = probeUrl or self.PROBE_URL
+        self.up = None
+        self.updated = None
+        self.proberTask = None
+        # instansen delas på klassnivå, event och prober skapas därför för den loop som körs just nu
+        self.loop = None
+        self.upEvent = None
+
+    def _bind(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.upEvent = asyncio.Event()
+            if self.up:
+                self.upEvent.set()
+            self.proberTask = None
+        return self.upEvent
+
+    def _set(self, up):
+        if up != self.up:
+            self.log.info(f"Network is {'up' if up else 'down'}")
+        self.up = up
+        self.updated = time.monotonic()
+        try:
+            upEvent = self._bind()
+        except RuntimeError:
+            return
+        if up:
+            upEvent.set()
+        else:
+            upEvent.clear()
+
+    def markUp(self):
+        self._set(True)
+
+    def markDown(self):
+        self._set(False)
+        self.startProber()
+
+    def isUp(self):
+        # None betyder okänt, dvs inget färskt utfall inom ttl
+        if self.updated is None or time.monotonic() - self.updated > self.ttl:
+            return None
+        return self.up
+
+    async def waitUp(self, timeout):
+        try:
+            await asyncio.wait_for(self._bind().wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def probe(self):
+        try:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.probeTimeout)) as _session:
+                async with _session.get(self.probeUrl) as resp:
+                    self._set(resp.status == 200)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self._set(False)
+
+        return self.up
+
+    async def _probeLoop(self):
+        try:
+            while not self.isUp():
+                if await self.probe():
+                    break
+                self.log.warning(f"Network probe failed; retrying in {self.probeInterval} seconds...")
+                await asyncio.sleep(self.probeInterval)
+
+        except asyncio.CancelledError:
+            pass
+
+        except Exception as e:
+            self.log.error(f"Exception in _probeLoop", error=e)
+
+    def startProber(self):
+        try:
+            self._bind()
+            if self.proberTask is None or self.proberTask.done():
+                self.proberTask = self.loop.create_task(self._probeLoop())
+        except RuntimeError:
+            pass
+
+    async def stopProber(self):
+        if self.proberTask is not None and not self.proberTask.done():
+            self.proberTask.cancel()
+            await asyncio.gather(self.proberTask, return_exceptions=True)
+        self.proberTask = None
+
+
+class RateLimiter:
+
+    def __init__(self, maxCalls=None, timeframe=None, throttleDelay=0, throttleErrorDelay=0):
+        self.maxCalls = maxCalls
+        self.timeframe = timeframe
+        self.throttleDelay = throttleDelay or 0
+        self.throttleErrorDelay = throttleErrorDelay or 0
+        self.callTimes = deque()  # time.monotonic()
+        self.lastCallTime = None
+        self.lastStatus = None
+
+    def __len__(self):
+        return len(self.callTimes)
+
+    @property
+    def windowed(self):
+        return bool(self.maxCalls and self.timeframe)
+
+    def _prune(self, now):
+        while self.callTimes and now - self.callTimes[0] > self.timeframe:
+            self.callTimes.popleft()
+
+    def delay(self, now=None):
+        now = time.monotonic() if now is None else now
+        if self.windowed:
+            self._prune(now)
+            if len(self.callTimes) >= self.maxCalls:
+                return self.callTimes[0] + self.timeframe - now
+
+        elif self.throttleDelay > 0 and self.lastCallTime is not None:
+            _delay = self.throttleErrorDelay if self.lastStatus == 429 else self.throttleDelay
+            return self.lastCallTime + _delay - now
+
+        return 0
+
+    def budget(self, now=None):
+        # andel av fönstret som finns kvar, utan fönster (t.ex. Flexit där MAX_CALLS är None) finns bara senaste svaret att gå på
+        if not self.windowed:
+            return 0.0 if self.lastStatus == 429 else 1.0
+        self._prune(time.monotonic() if now is None else now)
+        return max(0.0, 1 - len(self.callTimes) / self.maxCalls)
+
+    def acquire(self, now=None):
+        # reservera platsen direkt så att parallella anrop inte passerar samtidigt
+        now = time.monotonic() if now is None else now
+        if self.windowed:
+            self.callTimes.append(now)
+        self.lastCallTime = now
+
+    def record(self, status, counted=True, now=None):
+        now = time.monotonic() if now is None else now
+        if not counted and self.windowed:
+            self.callTimes.append(now)
+        self.lastCallTime = now
+        self.lastStatus = status
+
+
+class CircuitBreaker:
+    log = structlog.get_logger(__name__)
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name, failureThreshold=5, resetTimeout=60):
+        self.name = name
+        self.failureThreshold = failureThreshold
+        self.resetTimeout = resetTimeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.openedAt = None
+        self.trialStarted = None
+        self.opens = 0
+
+    def allow(self, now=None):
+        # öppen: allt nekas tills resetTimeout gått, halvöppen: ett provanrop i taget
+        now = time.monotonic() if now is None else now
+        if self.state == self.CLOSED:
+            return True
+
+        if self.state == self.OPEN:
+            if now - self.openedAt < self.resetTimeout:
+                return False
+            self.state = self.HALF_OPEN
+            self.log.info(f"{self.name} circuit half-open, sending trial request")
+
+        # ett provanrop som aldrig gav svar får ersättas efter resetTimeout
+        if self.trialStarted is not None and now - self.trialStarted < self.resetTimeout:
+            return False
+        self.trialStarted = now
+        return True
+
+    def retryAfter(self, now=None):
+        if self.state != self.OPEN:
+            return 0
+        now = time.monotonic() if now is None else now
+        return max(0, self.openedAt + self.resetTimeout - now)
+
+    def success(self):
+        if self.state != self.CLOSED:
+            self.log.info(f"{self.name} circuit closed")
+        self.state = self.CLOSED
+        self.failures = 0
+        self.openedAt = None
+        self.trialStarted = None
+
+    def failure(self, now=None):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failureThreshold):
+            self.log.warning(f"{self.name} circuit open for {self.resetTimeout} seconds", failures=self.failures)
+            self.state = self.OPEN
+            self.opens += 1
+            self.openedAt = time.monotonic() if now is None else now
+            self.trialStarted = None
+
+
+class LatencyHistogram:
+    __slots__ = ("counts", "count", "sum")
+
+    # övre gränser i sekunder, sista hinken är allt över BUCKETS[-1]
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        # linjär interpolation inom hinken, bra nog för att se var tiden går
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.BUCKETS[index - 1] if index else 0.0
+                upper = self.BUCKETS[index] if index < len(self.BUCKETS) else self.BUCKETS[-1]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.BUCKETS[-1]
+
+
+class LatencyRecorder:
+
+    METRIC = "apihandler_phase_seconds"
+    BUCKET_LABELS = tuple(str(bound) for bound in LatencyHistogram.BUCKETS) + ("+Inf",)
+    # lock/throttle/file/token/slot mäts i doSession, dns/queued/connect/ttfb via TraceConfig, body/parse runt läsningen
+    PHASES = ("lock", "throttle", "file", "token", "slot", "dns", "queued", "connect", "ttfb", "body", "parse", "total")
+
+    def __init__(self, name):
+        self.name = name
+        self.histograms = {}
+        self.lines = {}  # färdiga radprefix per (endpoint, phase) så att render bara lägger till siffrorna
+
+    def observe(self, endpoint, phase, seconds):
+        key = (endpoint, phase)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = LatencyHistogram()
+        histogram.observe(seconds)
+
+    def get(self):
+        out = {}
+        for (endpoint, phase), histogram in self.histograms.items():
+            out.setdefault(endpoint, {})[phase] = {"count": histogram.count,
+                                                   "sum": histogram.sum,
+                                                   "mean": histogram.sum / histogram.count if histogram.count else 0.0,
+                                                   "p50": histogram.quantile(0.5),
+                                                   "p95": histogram.quantile(0.95),
+                                                   "p99": histogram.quantile(0.99)}
+        return out
+
+    def reset(self):
+        self.histograms.clear()
+        self.lines.clear()
+
+    def _lines(self, key):
+        lines = self.lines.get(key)
+        if lines is None:
+            endpoint, phase = key
+            labels = f'handler="{self.name}",endpoint="{endpoint}",phase="{phase}"'
+            lines = self.lines[key] = ([f'{self.METRIC}_bucket{{{labels},le="{bound}"}} ' for bound in self.BUCKET_LABELS],
+                                       f"{self.METRIC}_sum{{{labels}}} ",
+                                       f"{self.METRIC}_count{{{labels}}} ")
+        return lines
+
+    def render(self, header=True):
+        lines = [f"# TYPE {self.METRIC} histogram"] if header else []
+        for key, histogram in sorted(self.histograms.items()):
+            buckets, sumLine, countLine = self._lines(key)
+            cumulative = 0
+            for prefix, count in zip(buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{prefix}{cumulative}")
+            lines.append(f"{sumLine}{histogram.sum}")
+            lines.append(f"{countLine}{histogram.count}")
+        return "\n".join(lines)
+
+
+def _traceConfig():
+    # en TraceConfig räcker för alla handlers, mätaren och endpointen följer med i trace_request_ctx
+    def _observe(ctx, phase, mark):
+        started = getattr(ctx, mark, None)
+        if started is not None:
+            ctx.trace_request_ctx["recorder"].observe(ctx.trace_request_ctx["endpoint"], phase, time.monotonic() - started)
+
+    def _mark(name):
+        async def _callback(session, ctx, params):
+            if ctx.trace_request_ctx is not None:
+                setattr(ctx, name, time.monotonic())
+        return _callback
+
+    def _phase(phase, mark):
+        async def _callback(session, ctx, params):
+            if ctx.trace_request_ctx is not None:
+                _observe(ctx, phase, mark)
+        return _callback
+
+    async def _requestEnd(session, ctx, params):
+        # ttfb räknas från att headers skickats, eller från start om signalen saknas
+        if ctx.trace_request_ctx is not None:
+            _observe(ctx, "ttfb", "sent" if hasattr(ctx, "sent") else "started")
+
+    traceConfig = aiohttp.TraceConfig()
+    traceConfig.on_request_start.append(_mark("started"))
+    traceConfig.on_dns_resolvehost_start.append(_mark("dns"))
+    traceConfig.on_dns_resolvehost_end.append(_phase("dns", "dns"))
+    traceConfig.on_connection_queued_start.append(_mark("queued"))
+    traceConfig.on_connection_queued_end.append(_phase("queued", "queued"))
+    # connect innehåller både TCP och TLS, aiohttp skiljer inte på dem
+    traceConfig.on_connection_create_start.append(_mark("connect"))
+    traceConfig.on_connection_create_end.append(_phase("connect", "connect"))
+    traceConfig.on_request_headers_sent.append(_mark("sent"))
+    traceConfig.on_request_end.append(_requestEnd)
+    traceConfig.freeze()
+    return traceConfig
+
+
 class APISessionHandler:
     log = structlog.get_logger(__name__)
 
+    # gemensam för alla handlers som delar eventloopen
+    network = NetworkState()
+    # loop: {(host, port): (gräns, semafor)}, en gräns per värd och den första handlern som når värden sätter den
+    hostSemaphores = weakref.WeakKeyDictionary()
+
     TIME_ZONE = "Europe/Stockholm"
     DATE_FORMAT = "YYYY-MM-DD HH:mm:ss"
 
+    AUDIT_OFF = "off"
+    AUDIT_METADATA = "metadata"
+    AUDIT_BODIES = "bodies"
+
+    # lägg till den i en egen commonSession (trace_configs=[APISessionHandler.traceConfig]) för att få dns/connect/ttfb
+    traceConfig = _traceConfig()
+
+    # retry-väntan sprids ±RETRY_JITTER så att väntande anrop inte kommer tillbaka samtidigt
+    RETRY_JITTER = 0.2
+    # kortaste väntan mellan två bakgrundsförnyelser av token
+    TOKEN_REFRESH_MIN_DELAY = 60
+    # kortaste backoff efter ClientConnectionError även när nätproben säger att nätet är uppe, dubblas per försök
+    CONNECTION_MIN_BACKOFF = 5
+
     # _instances = {}
 
     def __init__(self):
         pass
 
-    def __init__(self, name, tokenFileName, lastSessionFileName, headers, RETRIES, RETRY_DELAY, THROTTLE_DELAY, THROTTLE_ERROR_DELAY, loginUrls, MAX_CALLS=None, TIMEFRAME_MAX_CALLS=None, logoutUrls=None, BASE_URL=None, refreshUrls=None, data=None, auth=None, commonSession=None):
+    def __init__(self, name, tokenFileName, lastSessionFileName, headers, RETRIES, RETRY_DELAY, THROTTLE_DELAY, THROTTLE_ERROR_DELAY, loginUrls, MAX_CALLS=None, TIMEFRAME_MAX_CALLS=None, logoutUrls=None, BASE_URL=None, refreshUrls=None, data=None, auth=None, commonSession=None, MAX_IN_FLIGHT=4, MAX_IN_FLIGHT_PER_HOST=8, SESSION_CHECKPOINT_INTERVAL=60, SESSION_AUDIT="metadata", AUDIT_SAMPLE_EVERY=10, AUDIT_BUFFER_SIZE=100, AUDIT_FLUSH_BATCH=50, auditFileName=None, TOKEN_REFRESH_MARGIN=60*60, BREAKER_FAILURES=5, BREAKER_RESET_TIMEOUT=60, LATENCY_INSTRUMENTATION=True):
         self.name = name
         self.tokenFileName = tokenFileName
         self.lastSessionFileName = lastSessionFileName
@@ -38,6 +413,14 @@ class APISessionHandler:
         self.THROTTLE_ERROR_DELAY = THROTTLE_ERROR_DELAY
         self.MAX_CALLS = MAX_CALLS
         self.TIMEFRAME_MAX_CALLS = TIMEFRAME_MAX_CALLS
+        self.MAX_IN_FLIGHT = MAX_IN_FLIGHT
+        self.MAX_IN_FLIGHT_PER_HOST = MAX_IN_FLIGHT_PER_HOST
+        self.SESSION_CHECKPOINT_INTERVAL = SESSION_CHECKPOINT_INTERVAL
+        self.SESSION_AUDIT = SESSION_AUDIT
+        self.AUDIT_SAMPLE_EVERY = AUDIT_SAMPLE_EVERY
+        self.AUDIT_FLUSH_BATCH = AUDIT_FLUSH_BATCH
+        self.auditFileName = auditFileName
+        self.TOKEN_REFRESH_MARGIN = TOKEN_REFRESH_MARGIN
         self.loginUrls = loginUrls or []
         self.logoutUrls = logoutUrls or []
         # self.BASE_URL = BASE_URL
@@ -46,7 +429,8 @@ class APISessionHandler:
         self.auth = auth
         self.commonSession = commonSession
 
-        self.doSessionLock = asyncio.Lock()
+        self.requestSemaphore = asyncio.Semaphore(MAX_IN_FLIGHT)
+        self.throttleLock = asyncio.Lock()
         self.loginLock = asyncio.Lock()
         self.validateLock = asyncio.Lock()
         self.fileLock = asyncio.Lock()
@@ -55,18 +439,40 @@ class APISessionHandler:
         self.refreshTokenExpires = None
         self.lastWorkingUrl = None
         self.session = None
-        self.callTimes = deque()
+
+        self.rateLimiter = RateLimiter(MAX_CALLS, TIMEFRAME_MAX_CALLS, THROTTLE_DELAY, THROTTLE_ERROR_DELAY)
+        self.breaker = CircuitBreaker(name, BREAKER_FAILURES, BREAKER_RESET_TIMEOUT)
+        self.latency = LatencyRecorder(name) if LATENCY_INSTRUMENTATION else None
+        self.statusCounts = {}
+        self.counters = {"retries": 0, "throttleWaits": 0, "throttleSeconds": 0.0, "logins": 0, "tokenRefreshes": 0, "failFast": 0}
+        self.lastSession = {}
+        self.sessionFileLoaded = False
+        self.sessionDirty = False
+        self.lastCheckpoint = time.monotonic()
+        self.checkpointTask = None
+        self.inFlight = {}
+        self.tokenRefreshTask = None
+        self.hostLimitWarned = set()
+
+        self.audit = deque(maxlen=AUDIT_BUFFER_SIZE)
+        self.auditPending = []
+        self.auditCount = 0
+        self.auditTask = None
 
     @classmethod
     async def create(cls, *args, **params):
         try:
             # if cls not in cls._instances:
+            lazy = params.pop("lazy", False)
             instance = cls(*args, **params)
             # cls._instances[cls] = instance
             # instance.session = ClientSession(base_url=instance.BASE_URL) if instance.BASE_URL else ClientSession()
             # instance._session = params.pop("commonSession", None)
             # instance.session = await instance._init_session()
-            await instance._initSession()
+            # lazy skjuter upp session och login till första anropet
+            if not lazy:
+                await instance._initSession()
+                instance.startTokenRefresher()
             # return cls._instances[cls]
             return instance
 
@@ -110,37 +516,56 @@ class APISessionHandler:
     '''
 
     async def internetUP(self, retries=5, delay=5):
-        out = False
         for attempt in range(retries):
-            try:
-                async with aiohttp.ClientSession() as _session:
-                    async with _session.get('http://google.com') as resp:
-                        if resp.status == 200:
-                            self.log.info("Internet connection is up")
-                            out = True
-
-                return out
+            if await self.network.probe():
+                self.log.info("Internet connection is up")
+                return True
 
-            except aiohttp.ClientConnectionError:
-                self.log.warning(f"Attempt {attempt + 1}/{retries} failed; retrying in {delay} seconds...")
-                await asyncio.sleep(delay)
+            self.log.warning(f"Attempt {attempt + 1}/{retries} failed; retrying in {delay} seconds...")
+            await asyncio.sleep(delay)
 
         self.log.error("Failed to create session: network is unavailable.")
+        return False
 
     async def _initSession(self):
         try:
             if self.session is None or self.session.closed:
-                if await self.internetUP():
-                    self.session = self.commonSession if self.commonSession is not None else aiohttp.ClientSession()
+                self.session = self.commonSession if self.commonSession is not None else aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit_per_host=self.MAX_IN_FLIGHT_PER_HOST),
+                                                                                                               trace_configs=[self.traceConfig] if self.latency is not None else None)
 
         except Exception as e:
             self.log.error(f"Exception in _init_session", error=e)
 
     async def closeSession(self):
+        # avslutar handlern, för att bara koppla upp på nytt används _resetSession
+        await self.stopTokenRefresher()
+        await self._checkpointSessionFile(force=True)
+        await self._flushAudit()
+        await self._resetSession()
+
+    async def _resetSession(self):
         if self.session and not self.session.closed:
             await self.session.close()
             self.session = None
 
+    def _jitter(self, delay):
+        return delay * random.uniform(1 - self.RETRY_JITTER, 1 + self.RETRY_JITTER)
+
+    async def _retrySleep(self, delay):
+        self.counters["retries"] += 1
+        await asyncio.sleep(self._jitter(delay))
+
+    def _hostSemaphore(self, url):
+        semaphores = self.hostSemaphores.setdefault(asyncio.get_running_loop(), {})
+        key = (url.host, url.port)
+        if key not in semaphores:
+            semaphores[key] = (self.MAX_IN_FLIGHT_PER_HOST, asyncio.Semaphore(self.MAX_IN_FLIGHT_PER_HOST))
+        limit, semaphore = semaphores[key]
+        if limit != self.MAX_IN_FLIGHT_PER_HOST and key not in self.hostLimitWarned:
+            self.hostLimitWarned.add(key)
+            self.log.warning(f"{self.name} MAX_IN_FLIGHT_PER_HOST={self.MAX_IN_FLIGHT_PER_HOST} ignored for {url.host}, another handler already limits it to {limit}")
+        return semaphore
+
     async def localDoLogin(self, internalCall, skipThrottle=True):
         pass
 
@@ -159,149 +584,218 @@ class APISessionHandler:
     async def localPreDoSession(self, param):
         pass
 
+    def localEndpoint(self, url):
+        return url.path
+
+    def _observe(self, endpoint, phase, started):
+        if self.latency is not None:
+            self.latency.observe(endpoint, phase, time.monotonic() - started)
+
+    def getLatency(self):
+        return self.latency.get() if self.latency is not None else {}
+
+    def upstreamUnavailable(self):
+        # samma villkor som får doSession att ge None utan att fråga servern, kretsen öppen eller nätet nere
+        return self.breaker.state != CircuitBreaker.CLOSED or self.network.isUp() is False
+
+    def getStats(self):
+        return {**self.counters, "status": dict(self.statusCounts), "circuit": self.breaker.state, "circuitOpens": self.breaker.opens}
+
+    def getLatencyText(self):
+        return self.latency.render() if self.latency is not None else ""
+
     async def doSession(self, internalCall=False, skipThrottle=False, **kwargs):
 
-        async def _writeSessionFile(url, status, text):
+        async def _writeSessionFile(url, status, text=None, body=None, size=None):
             try:
-                _now = arrow.now(self.TIME_ZONE)
-
-                if self.MAX_CALLS and self.TIMEFRAME_MAX_CALLS:
-                    self.callTimes.append(_now)
-                    # Remove timestamps that are outside the current timeframe
-                    # while self.callTimes and (_now - self.callTimes[0]).total_seconds() > self.TIMEFRAME_MAX_CALLS:
-                    #    self.callTimes.popleft()
-
-                    await self._writeFileAsync(self.lastSessionFileName, {"lastSessionTime": _now.format(self.DATE_FORMAT),
-                                                                          "lastStatus": status,
-                                                                          "lastUrl": url,
-                                                                          "lastText": text,
-                                                                          "callTimes": [ts.format(self.DATE_FORMAT) for ts in self.callTimes or []]})
-                else:
-                    await self._writeFileAsync(self.lastSessionFileName, {"lastSessionTime": _now.format(self.DATE_FORMAT),
-                                                                          "lastStatus": status,
-                                                                          "lastUrl": url,
-                                                                          "lastText": text})
+                self.statusCounts[status] = self.statusCounts.get(status, 0) + 1
+                self.rateLimiter.record(status, counted=not skipThrottle)
+                self.lastSession = {"lastSessionTime": time.time(),
+                                    "lastStatus": status,
+                                    "lastUrl": url,
+                                    "lastText": text}
+                self.sessionDirty = True
+                self._scheduleCheckpoint()
+
+                if self.SESSION_AUDIT != self.AUDIT_OFF:
+                    _latency = time.monotonic() - _started if _started is not None else None
+                    self._auditRecord(url, status, _latency, size if size is not None else len(text or ""), text, body)
 
             except Exception as e:
                 self.log.error(f"Exception in _writeSessionFile", error=e)
 
         async def _waitForThrottle():
             try:
-                _now = arrow.now(self.TIME_ZONE)
-                if self.lastSessionFileName:
-                    lastSessionData = await self._readFileAsync(self.lastSessionFileName)
-                    if lastSessionData:
-                        if self.MAX_CALLS and self.TIMEFRAME_MAX_CALLS:
-                            self.callTimes = deque([arrow.get(ts, tzinfo=self.TIME_ZONE) for ts in lastSessionData.get("callTimes", [])])
-                            # Remove timestamps that are outside the current timeframe
-                            while self.callTimes and (_now - self.callTimes[0]).total_seconds() > self.TIMEFRAME_MAX_CALLS:
-                                self.callTimes.popleft()
-
-                            # Check if the number of calls exceeds the maximum allowed
-                            if len(self.callTimes) >= self.MAX_CALLS:
-                                nextCallTime = self.callTimes[0].shift(seconds=self.TIMEFRAME_MAX_CALLS)
-                                delaySeconds = (nextCallTime - _now).total_seconds()
-                                self.log.info(f"{self.name} waiting {int(delaySeconds)} seconds due to rate limiting", lencallTimes=len(self.callTimes))
-                                await asyncio.sleep(delaySeconds)
-                                # self.callTimes.clear()
-
-                        elif self.THROTTLE_DELAY > 0:
-                            lastSessionTime = arrow.get(lastSessionData.get("lastSessionTime"), tzinfo=self.TIME_ZONE)
-                            lastStatus = lastSessionData.get("lastStatus")
-                            delay = self.THROTTLE_ERROR_DELAY if lastStatus == 429 else self.THROTTLE_DELAY
-                            nextCallTime = lastSessionTime.shift(seconds=delay)
-                            if nextCallTime > _now:
-                                delaySeconds = (nextCallTime - _now).total_seconds()
-                                self.log.info(f"{self.name} waiting {int(delaySeconds)} seconds before next call")
-                                await asyncio.sleep(delaySeconds)
-
+                if not self.sessionFileLoaded:
+                    _mark = time.monotonic()
+                    await self._loadSessionFile()
+                    self._observe(_endpoint, "file", _mark)
+                _mark = time.monotonic()
+                delaySeconds = self.rateLimiter.delay()
+                while delaySeconds > 0:
+                    if self.rateLimiter.windowed:
+                        self.log.info(f"{self.name} waiting {int(delaySeconds)} seconds due to rate limiting", lencallTimes=len(self.rateLimiter))
                     else:
-                        self.log.warning(f"{self.name} lastsessionfile damaged or missing")
+                        self.log.info(f"{self.name} waiting {int(delaySeconds)} seconds before next call")
+                    self.counters["throttleWaits"] += 1
+                    self.counters["throttleSeconds"] += delaySeconds
+                    await asyncio.sleep(delaySeconds)
+                    delaySeconds = self.rateLimiter.delay()
+                self.rateLimiter.acquire()
+                self._observe(_endpoint, "throttle", _mark)
 
             except Exception as e:
                 self.log.error(f"Exception in _waitForThrottle", error=e)
 
         async def _innerDoSession():
-            nonlocal kwargs
+            nonlocal kwargs, _started
+            # login/refresh går igenom även när kretsen är öppen, annars kan provanropet aldrig logga in
+            _slot = nullcontext() if internalCall else self.requestSemaphore
             for attempt in range(self.RETRIES):
+                # proben har sett att nätet är nere, inget anrop kommer fram förrän den ser det uppe igen
+                if not internalCall and self.network.isUp() is False:
+                    self.counters["failFast"] += 1
+                    self.log.warning(f"{self.name} network down, failing fast")
+                    return None
+
+                if not internalCall and not self.breaker.allow():
+                    self.counters["failFast"] += 1
+                    self.log.warning(f"{self.name} circuit {self.breaker.state}, failing fast", retryAfter=int(self.breaker.retryAfter()))
+                    return None
+
                 try:
                     if not skipThrottle:
-                        await _waitForThrottle()
+                        _mark = time.monotonic()
+                        async with self.throttleLock:
+                            self._observe(_endpoint, "lock", _mark)
+                            await _waitForThrottle()
+                        _mark = time.monotonic()
                         if not await self._tokenValid():
                             if not await self.login(internalCall=True):
                                 return None
+                        self._observe(_endpoint, "token", _mark)
 
                     for index, url in enumerate(_urls):
                         kwargs["url"] = self.BASE_URL.join(URL(url)) if self.BASE_URL is not None else URL(url)
                         kwargs["headers"] = self.headers
                         newKwargs = await self.localPreDoSession(kwargs)
                         kwargs = newKwargs if newKwargs is not None else kwargs
+                        if self.latency is not None:
+                            kwargs["trace_request_ctx"] = {"recorder": self.latency, "endpoint": _endpoint}
                         self.log.debug(f"{self.name} preforming request to {kwargs.get('url')}")
                         # Ensure shared session is initialized
                         await self._initSession()
-                        async with self.session.request(**kwargs) as response:
-                            if 200 <= response.status < 300:
-                                content_type = response.headers.get('Content-Type', '').lower()
-                                if 'application/json' in content_type:
-                                    result = await response.json()
-                                    await _writeSessionFile(kwargs.get('url').human_repr(), response.status, ujson.dumps(result))
-                                    if not _urlPool or self.localUrlPoolCheck(result):
-                                        self.lastWorkingUrl = url
-                                        return result
-                                    if index == len(_urls) - 1:  # last item
-                                        self.log.warning(f"{self.name} failed with urlPool attempt {attempt+1}, retrying in {self.RETRY_DELAY} seconds...")
-                                        await asyncio.sleep(self.RETRY_DELAY)
+                        _started = time.monotonic()
+                        # väntan och omloggning görs först när svaret och semaforerna släppts
+                        _retryDelay = None
+                        _nextAttempt = False
+                        _relogin = False
+                        async with _slot, self._hostSemaphore(kwargs["url"]):
+                            self._observe(_endpoint, "slot", _started)
+                            async with self.session.request(**kwargs) as response:
+                                self.network.markUp()
+                                if 200 <= response.status < 300:
+                                    self.breaker.success()
+                                    content_type = response.headers.get('Content-Type', '').lower()
+                                    if 'application/json' in content_type:
+                                        _mark = time.monotonic()
+                                        raw = await response.read()
+                                        self._observe(_endpoint, "body", _mark)
+                                        _mark = time.monotonic()
+                                        result = await response.json()
+                                        self._observe(_endpoint, "parse", _mark)
+                                        await _writeSessionFile(kwargs.get('url').human_repr(), response.status, body=result, size=len(raw))
+                                        if not _urlPool or self.localUrlPoolCheck(result):
+                                            self.lastWorkingUrl = url
+                                            return result
+                                        if index == len(_urls) - 1:  # last item
+                                            self.log.warning(f"{self.name} failed with urlPool attempt {attempt+1}, retrying in {self.RETRY_DELAY} seconds...")
+                                            _retryDelay = self.RETRY_DELAY
+                                    else:
+                                        self.log.error(f"{self.name} received unexpected content type: {content_type}. Expected 'application/json'. Response text: {await response.text()}")
+                                        await _writeSessionFile(kwargs.get('url').human_repr(), response.status, await response.text())
+                                        if index == len(_urls) - 1:
+                                            _retryDelay = self.RETRY_DELAY
+
+                                elif response.status == 401:
+                                    self.breaker.success()
+                                    self.log.warning(f"{self.name} 401 unauthorized attempt {attempt+1}")
+                                    await _writeSessionFile(kwargs.get('url').human_repr(), response.status, await response.text())
+                                    _relogin = True
+
+                                elif response.status == 404:
+                                    self.breaker.success()
+                                    self.log.error(f"{self.name} 404 not found attempt {attempt+1}")
+                                    await _writeSessionFile(kwargs.get('url').human_repr(), response.status, await response.text())
+                                    return
+
+                                elif response.status == 429:
+                                    self.breaker.failure()
+                                    await _writeSessionFile(kwargs.get('url').human_repr(), response.status, await response.text())
+                                    self.log.warning(f"{self.name} 429 too many requests attempt {attempt+1}, retrying after {self.RETRY_DELAY} seconds...", lencallTimes=len(self.rateLimiter))
+                                    _retryDelay = self.RETRY_DELAY
+                                    _nextAttempt = True
+
                                 else:
-                                    self.log.error(f"{self.name} received unexpected content type: {content_type}. Expected 'application/json'. Response text: {await response.text()}")
+                                    # bara 5xx säger något om tjänsten, övriga 4xx är fel i anropet och får inte öppna kretsen
+                                    if response.status >= 500:
+                                        self.breaker.failure()
+                                    else:
+                                        self.breaker.success()
+                                    self.log.error(f"{self.name} request failed with status {response.status} attempt {attempt+1} retrying in {self.RETRY_DELAY} seconds...", url=kwargs.get('url'), params=kwargs.get("params"))
                                     await _writeSessionFile(kwargs.get('url').human_repr(), response.status, await response.text())
-                                    if index == len(_urls) - 1:
-                                        await asyncio.sleep(self.RETRY_DELAY)
-
-                            elif response.status == 401:
-                                self.log.warning(f"{self.name} 401 unauthorized attempt {attempt+1}")
-                                await _writeSessionFile(kwargs.get('url').human_repr(), response.status, await response.text())
-                                if not self.loginLock.locked():
-                                    if not await self.login(internalCall=True, forceLogin=True):
-                                        return None
-                                    self.log.warning(f"{self.name} retrying request attempt {attempt+1} in {self.RETRY_DELAY} seconds...")
-                                    await asyncio.sleep(self.RETRY_DELAY)
-                                    break
-
-                            elif response.status == 404:
-                                self.log.error(f"{self.name} 404 not found attempt {attempt+1}")
-                                await _writeSessionFile(kwargs.get('url').human_repr(), response.status, await response.text())
-                                return
-
-                            elif response.status == 429:
-                                await _writeSessionFile(kwargs.get('url').human_repr(), response.status, await response.text())
-                                self.log.warning(f"{self.name} 429 too many requests attempt {attempt+1}, retrying after {self.RETRY_DELAY} seconds...", callTimes=self.callTimes)
-                                await asyncio.sleep(self.RETRY_DELAY)
-                                break
+                                    _retryDelay = self.RETRY_DELAY
+
+                        if _relogin and not self.loginLock.locked():
+                            if not await self.login(internalCall=True, forceLogin=True):
+                                return None
+                            self.log.warning(f"{self.name} retrying request attempt {attempt+1} in {self.RETRY_DELAY} seconds...")
+                            await self._retrySleep(self.RETRY_DELAY)
+                            break
 
-                            else:
-                                self.log.error(f"{self.name} request failed with status {response.status} attempt {attempt+1} retrying in {self.RETRY_DELAY} seconds...", url=kwargs.get('url'), params=kwargs.get("params"))
-                                await _writeSessionFile(kwargs.get('url').human_repr(), response.status, await response.text())
-                                await asyncio.sleep(self.RETRY_DELAY)
+                        if _retryDelay is not None:
+                            await self._retrySleep(_retryDelay)
+                            if _nextAttempt:
+                                break
 
                 except aiohttp.ClientConnectionError as e:
+                    self.breaker.failure()
                     _delay = min(self.RETRY_DELAY * (2 ** attempt), self.RETRY_DELAY * (2 ** self.RETRIES))
                     _status = response.status if 'response' in locals() else 500  # Default to 500 if response is not defined
                     self.log.error(f"{self.name} ClientConnectionError attempt {attempt+1} retrying in {_delay} seconds...", error=e, url=kwargs.get('url'), params=kwargs.get("params"))
                     await _writeSessionFile(url, _status, f"{type(e).__name__}: {str(e)}")
-                    await asyncio.sleep(_delay)
+                    self.network.markDown()
+                    self.counters["retries"] += 1
+                    # vänta på proben istället för hela backoffen om nätet kommer tillbaka, men proben frågar inte API:t
+                    # så en kortare backoff väntas alltid ut, annars försvinner den helt när bara API:t ligger nere
+                    _waitStart = time.monotonic()
+                    await self.network.waitUp(self._jitter(_delay))
+                    _rest = self._jitter(min(_delay, self.CONNECTION_MIN_BACKOFF * (2 ** attempt))) - (time.monotonic() - _waitStart)
+                    if _rest > 0:
+                        await asyncio.sleep(_rest)
                     # reset sessionen bara och det inte är en gemensam session
                     if self.commonSession is None:
-                        await self.closeSession()
+                        await self._resetSession()
 
                 except Exception as e:
+                    self.breaker.failure()
                     self.log.error(f"{self.name} Exception in _innerDoSession attempt {attempt+1} retrying in {self.RETRY_DELAY} seconds...", url=kwargs.get('url'), params=kwargs.get("params"))
                     await _writeSessionFile(url, 999, f"{type(e).__name__}: {str(e)}")
-                    await asyncio.sleep(self.RETRY_DELAY)
+                    await self._retrySleep(self.RETRY_DELAY)
 
             self.log.error(f"{self.name} _innerDoSession max retries reached")
 
+        async def _timedDoSession():
+            _begin = time.monotonic()
+            try:
+                return await _innerDoSession()
+            finally:
+                self._observe(_endpoint, "total", _begin)
+
+        _started = None
         _urls = kwargs.pop("url")
         _urls = _urls if isinstance(_urls, list) else [_urls]
+        _endpoint = self.localEndpoint(URL(_urls[0]))
         _urlPool = len(_urls) > 1
 
         if _urlPool and self.lastWorkingUrl:
@@ -318,11 +812,26 @@ class APISessionHandler:
             elif self.lastWorkingUrl in _urls:
                 _urls = self._moveToFront(self.lastWorkingUrl, _urls)
 
-        if not internalCall:
-            async with self.doSessionLock:
-                return await _innerDoSession()
-        else:
-            return await _innerDoSession()
+        # login/refresh serialiseras av loginLock, övriga anrop får överlappa upp till MAX_IN_FLIGHT
+        if internalCall:
+            return await _timedDoSession()
+
+        if self.tokenRefreshTask is None:
+            self.startTokenRefresher()
+
+        if kwargs.get("method") != "GET":
+            return await _timedDoSession()
+
+        # identiska GET som redan är på väg delar på samma svar, params får vara allt som aiohttp tar (dict, lista med par, sträng)
+        try:
+            key = (tuple(str(url) for url in _urls), URL("").with_query(kwargs["params"]).query_string if kwargs.get("params") else "")
+        except (TypeError, ValueError):
+            return await _timedDoSession()
+        if key not in self.inFlight:
+            task = asyncio.ensure_future(_timedDoSession())
+            task.add_done_callback(lambda _: self.inFlight.pop(key, None))
+            self.inFlight[key] = task
+        return await asyncio.shield(self.inFlight[key])
 
     async def login(self, internalCall=False, forceLogin=False):
         try:
@@ -333,12 +842,14 @@ class APISessionHandler:
                 if self.refreshUrls and await self._tokenValid(self.refreshTokenExpires):
                     self.log.info(f"{self.name} refreshing token")
                     if await self.localDoRefresh(internalCall=internalCall):
+                        self.counters["tokenRefreshes"] += 1
                         return True
                 else:
                     self.log.info(f"{self.name} has no refreshUrl or refreshtoken expired")
 
                 self.log.info(f"{self.name} performing login")
                 if await self.localDoLogin(internalCall=internalCall):
+                    self.counters["logins"] += 1
                     return True
 
         except Exception as e:
@@ -347,22 +858,75 @@ class APISessionHandler:
     async def logout(self):
         await self.localDoLogout()
 
+    def startTokenRefresher(self):
+        if self.tokenFileName is None or self.TOKEN_REFRESH_MARGIN is None:
+            return
+        if self.tokenRefreshTask is None or self.tokenRefreshTask.done():
+            self.tokenRefreshTask = asyncio.get_running_loop().create_task(self._tokenRefreshLoop())
+
+    async def stopTokenRefresher(self):
+        # anropad inifrån refreshern själv finns inget att vänta in, den skulle bara vänta på sig själv
+        if self.tokenRefreshTask is asyncio.current_task():
+            return
+        if self.tokenRefreshTask is not None and not self.tokenRefreshTask.done():
+            self.tokenRefreshTask.cancel()
+            await asyncio.gather(self.tokenRefreshTask, return_exceptions=True)
+        self.tokenRefreshTask = None
+
+    async def _tokenRefreshLoop(self):
+        # förnyar token TOKEN_REFRESH_MARGIN sekunder innan den går ut så att inget anrop behöver vänta på login
+        expires = lifetime = None
+        while True:
+            try:
+                if self.tokenExpires is None:
+                    ok = await self.login()
+                else:
+                    now = time.time()
+                    if self.tokenExpires != expires:
+                        # livslängden skattas när en ny token dyker upp, marginalen får aldrig äta upp mer än halva
+                        expires = self.tokenExpires
+                        lifetime = self._epoch(expires) - now
+                    delay = self._epoch(expires) - now - min(self.TOKEN_REFRESH_MARGIN, lifetime / 2)
+                    if delay > 0:
+                        await asyncio.sleep(min(max(delay, self.TOKEN_REFRESH_MIN_DELAY), 24*60*60))
+                        continue
+                    self.log.info(f"{self.name} token about to expire, renewing in background")
+                    ok = await self.login(forceLogin=True)
+
+                if not ok:
+                    self.log.warning(f"{self.name} background token refresh failed, retrying in {self.RETRY_DELAY} seconds...")
+                    await asyncio.sleep(max(self.RETRY_DELAY, 1))
+                else:
+                    # skydd mot en server som lämnar tillbaka samma token eller en som redan gått ut
+                    await asyncio.sleep(self.TOKEN_REFRESH_MIN_DELAY)
+
+            except asyncio.CancelledError:
+                break
+
+            except Exception as e:
+                self.log.error(f"Exception in _tokenRefreshLoop", error=e)
+                await asyncio.sleep(max(self.RETRY_DELAY, 1))
+
     async def _tokenValid(self, timecheck=None):
         if self.tokenFileName is not None:
             if timecheck is None:
                 timecheck = self.tokenExpires
-            now = arrow.now(self.TIME_ZONE)
             async with self.validateLock:
-                if timecheck is None or now >= timecheck:
+                if timecheck is None or time.time() >= self._epoch(timecheck):
                     return False
         return True
 
+    @staticmethod
+    def _epoch(value):
+        # tokenExpires kan vara epoch, datetime eller arrow beroende på handler
+        return value if isinstance(value, (int, float)) else value.timestamp()
+
     async def _getTokenFromFile(self):
         try:
             tokenData = await self._readFileAsync(self.tokenFileName)
             if tokenData:
                 token = tokenData.get("token")
-                self.tokenExpires = arrow.get(tokenData.get("tokenExpires"), tzinfo=self.TIME_ZONE)
+                self.tokenExpires = self._parseTime(tokenData.get("tokenExpires"))
                 if await self._tokenValid():
                     self.log.info(f"{self.name} setting token from file")
                     self.localSetToken(token)
@@ -380,7 +944,109 @@ class APISessionHandler:
 
     async def _writeTokenToFile(self, token):
         await self._writeFileAsync(self.tokenFileName, {"token": token,
-                                                        "tokenExpires": self.tokenExpires.format(self.DATE_FORMAT)})
+                                                        "tokenExpires": self._formatTime(self.tokenExpires)})
+
+    def _parseTime(self, text):
+        # DATE_FORMAT i TIME_ZONE -> epoch
+        return datetime.strptime(text, "%Y-%m-%d %H:%M:%S").replace(tzinfo=ZoneInfo(self.TIME_ZONE)).timestamp()
+
+    def _formatTime(self, value):
+        return datetime.fromtimestamp(self._epoch(value), ZoneInfo(self.TIME_ZONE)).strftime("%Y-%m-%d %H:%M:%S")
+
+    def _toMonotonic(self, ts):
+        return time.monotonic() - (time.time() - self._parseTime(ts))
+
+    def _fromMonotonic(self, t):
+        return self._formatTime(time.time() - (time.monotonic() - t))
+
+    async def _loadSessionFile(self):
+        # läses bara en gång, för att återställa throttle-läget efter omstart
+        if self.sessionFileLoaded:
+            return
+        self.sessionFileLoaded = True
+        if not self.lastSessionFileName:
+            return
+
+        try:
+            lastSessionData = await self._readFileAsync(self.lastSessionFileName)
+            if not lastSessionData:
+                self.log.warning(f"{self.name} lastsessionfile damaged or missing")
+                return
+
+            if self.rateLimiter.windowed:
+                self.rateLimiter.callTimes.extendleft(reversed([self._toMonotonic(ts) for ts in lastSessionData.get("callTimes", [])]))
+
+            if lastSessionData.get("lastSessionTime"):
+                self.rateLimiter.lastCallTime = self._toMonotonic(lastSessionData["lastSessionTime"])
+                self.rateLimiter.lastStatus = lastSessionData.get("lastStatus")
+
+        except Exception as e:
+            self.log.error(f"Exception in _loadSessionFile", error=e)
+
+    def _scheduleCheckpoint(self):
+        if not self.lastSessionFileName or self.SESSION_CHECKPOINT_INTERVAL is None:
+            return
+        if time.monotonic() - self.lastCheckpoint < self.SESSION_CHECKPOINT_INTERVAL:
+            return
+        if self.checkpointTask is None or self.checkpointTask.done():
+            self.checkpointTask = asyncio.get_running_loop().create_task(self._checkpointSessionFile())
+
+    def _auditRecord(self, url, status, latency, size, text=None, body=None):
+        entry = {"time": time.time(),
+                 "url": url,
+                 "status": status,
+                 "latency": latency,
+                 "size": size}
+
+        if self.SESSION_AUDIT == self.AUDIT_BODIES:
+            # felsvar sparas alltid, lyckade svar bara var AUDIT_SAMPLE_EVERY:e
+            self.auditCount += 1
+            if text is not None and not 200 <= status < 300:
+                entry["text"] = text
+            elif body is not None and self.auditCount % self.AUDIT_SAMPLE_EVERY == 0:
+                entry["body"] = body
+
+        self.audit.append(entry)
+
+        if self.auditFileName:
+            self.auditPending.append(entry)
+            if len(self.auditPending) >= self.AUDIT_FLUSH_BATCH and (self.auditTask is None or self.auditTask.done()):
+                self.auditTask = asyncio.get_running_loop().create_task(self._flushAudit())
+
+    def getAudit(self):
+        return list(self.audit)
+
+    async def _flushAudit(self):
+        if not self.auditFileName or not self.auditPending:
+            return
+
+        pending, self.auditPending = self.auditPending, []
+        import aiofiles
+        async with self.fileLock:
+            try:
+                async with aiofiles.open(self.auditFileName, mode="a", encoding="utf-8") as f:
+                    await f.write("".join(f"{ujson.dumps(entry)}\n" for entry in pending))
+
+            except Exception as e:
+                self.log.error(f"Exception in _flushAudit", filename=self.auditFileName, error=e)
+
+    async def _checkpointSessionFile(self, force=False):
+        if not self.lastSessionFileName or not self.sessionDirty:
+            return
+        if not force and self.SESSION_CHECKPOINT_INTERVAL is None:
+            return
+
+        try:
+            self.sessionDirty = False
+            self.lastCheckpoint = time.monotonic()
+            contents = dict(self.lastSession)
+            contents["lastSessionTime"] = self._formatTime(contents["lastSessionTime"])
+            if self.rateLimiter.windowed:
+                contents["callTimes"] = [self._fromMonotonic(t) for t in self.rateLimiter.callTimes]
+            await self._writeFileAsync(self.lastSessionFileName, contents)
+
+        except Exception as e:
+            self.log.error(f"Exception in _checkpointSessionFile", error=e)
 
     @staticmethod
     def _moveToFront(item, lst):
@@ -394,6 +1060,7 @@ class APISessionHandler:
         return new_lst
 
     async def _readFileAsync(self, filename):
+        import aiofiles
         async with self.fileLock:
             try:
                 if os.path.exists(filename):
@@ -407,6 +1074,7 @@ class APISessionHandler:
                 return {}
 
     async def _writeFileAsync(self, filename, contents):
+        import aiofiles
         async with self.fileLock:
             try:
                 async with aiofiles.open(filename, mode="w", encoding="utf-8") as f:
@@ -424,7 +1092,7 @@ class APIMelcloud(APISessionHandler):
             self.log.info(f"{self.name} login success")
             _token = out['LoginData']['ContextKey']
             self.localSetToken(_token)
-            self.tokenExpires = arrow.get(out['LoginData']['Expiry']).to(self.TIME_ZONE)
+            self.tokenExpires = _arrow().get(out['LoginData']['Expiry']).to(self.TIME_ZONE)
             await self._writeTokenToFile(_token)
             return True
         else:
@@ -442,8 +1110,8 @@ class APIFlexitgo(APISessionHandler):
             self.log.info(f"{self.name} login success")
             _token = f"Bearer {out['access_token']}"
             self.localSetToken(_token)
-            fmt = "ddd, DD MMM YYYY HH:mm:ss ZZZ"
-            self.tokenExpires = arrow.get(out[".expires"], fmt).to(self.TIME_ZONE)
+            # RFC 1123, t.ex. "Tue, 14 Dec 2021 10:24:03 GMT"
+            self.tokenExpires = parsedate_to_datetime(out[".expires"])
             await self._writeTokenToFile(_token)
             return True
         else:
@@ -452,6 +1120,12 @@ class APIFlexitgo(APISessionHandler):
     def localSetToken(self, token):
         self.headers["Authorization"] = token if token else None
 
+    def localEndpoint(self, url):
+        # PUT-adressen innehåller datapunkten, alla samlas under en endpoint
+        if url.path.startswith("/DataPoints/") and url.path != "/DataPoints/Values":
+            return "/DataPoints/{id}"
+        return url.path
+
 
 class APIEnegic(APISessionHandler):
 
@@ -467,7 +1141,7 @@ class APIEnegic(APISessionHandler):
             self.log.info(f"{self.name} refresh success")
             _token = out["TokenInfo"]["Token"]
             self.localSetToken(_token)
-            self.tokenExpires = arrow.get(out["TokenInfo"]["ValidTo"]).to(self.TIME_ZONE)
+            self.tokenExpires = _arrow().get(out["TokenInfo"]["ValidTo"]).to(self.TIME_ZONE)
             await self._writeTokenToFile(_token)
             # await self._getAccountOverview()
             return True
@@ -480,7 +1154,7 @@ class APIEnegic(APISessionHandler):
             self.log.info(f"{self.name} login success")
             _token = out["TokenInfo"]["Token"]
             self.localSetToken(_token)
-            self.tokenExpires = arrow.get(out["TokenInfo"]["ValidTo"]).to(self.TIME_ZONE)
+            self.tokenExpires = _arrow().get(out["TokenInfo"]["ValidTo"]).to(self.TIME_ZONE)
             await self._writeTokenToFile(_token)
             return True
         else:
@@ -498,9 +1172,9 @@ class APIVerisure(APISessionHandler):
         try:
             for cookie in self.session.cookie_jar:
                 if cookie.key == "vs-refresh":
-                    self.refreshTokenExpires = arrow.get(cookie["expires"], self.fmt).to(self.TIME_ZONE)
+                    self.refreshTokenExpires = _arrow().get(cookie["expires"], self.fmt).to(self.TIME_ZONE)
                 elif cookie.key == "vs-access":
-                    self.tokenExpires = arrow.get(cookie["expires"], self.fmt).to(self.TIME_ZONE)
+                    self.tokenExpires = _arrow().get(cookie["expires"], self.fmt).to(self.TIME_ZONE)
             return True
 
         except Exception as e:
@@ -558,7 +1232,7 @@ class APITelldusLocal(APISessionHandler):
             self.log.info(f"{self.name} refresh success")
             _token = out["token"]
             self.localSetToken(_token)
-            self.tokenExpires = arrow.get(out["expires"])
+            self.tokenExpires = _arrow().get(out["expires"])
             await self._writeTokenToFile(_token)
             return True
         else:
@@ -570,7 +1244,7 @@ class APITelldusLocal(APISessionHandler):
             self.log.info(f"{self.name} login success")
             _token = out["token"]
             self.localSetToken(_token)
-            self.tokenExpires = arrow.get(out["expires"])
+            self.tokenExpires = _arrow().get(out["expires"])
             await self._writeTokenToFile(_token)
             return True
         else:
@@ -592,21 +1266,21 @@ class APITelldusLive(APISessionHandler):
         return out
 
     async def localDoLogin(self, internalCall, skipThrottle=True):
-        self.tokenExpires = arrow.get("2099-12-31 23:59:59")
+        self.tokenExpires = _arrow().get("2099-12-31 23:59:59")
         return True
 
 
 class APIShelly(APISessionHandler):
 
     async def localDoLogin(self, internalCall, skipThrottle=True):
-        self.tokenExpires = arrow.get("2099-12-31 23:59:59")
+        self.tokenExpires = _arrow().get("2099-12-31 23:59:59")
         return True
 
 
 class APIOmlet(APISessionHandler):
 
     async def localDoLogin(self, internalCall, skipThrottle=True):
-        self.tokenExpires = arrow.get("2099-12-31 23:59:59")
+        self.tokenExpires = _arrow().get("2099-12-31 23:59:59")
         return True
     
     def localSetToken(self, token):
@@ -29,7 +29,7 @@ class TimeoutHTTPAdapter(HTTPAdapter):
     
 class FlexitGo:
 
-    def __init__(self):
+    def __init__(self, apiUrl="https://api.climatixic.com"):
 
         # Put paths
         self.MODE_AWAY_PUT_PATH                 = ";1!005000032000055"
@@ -120,7 +120,7 @@ class FlexitGo:
             self.LAST_RESTART_REASON_PATH,
         ]
 
-        self.API_URL = "https://api.climatixic.com"
+        self.API_URL = apiUrl
         self.TOKEN_PATH = f"{self.API_URL}/Token"
         self.PLANTS_PATH = f"{self.API_URL}/Plants"
         self.DATAPOINTS_PATH = f"{self.API_URL}/DataPoints"
@@ -260,7 +260,7 @@ class FlexitGo:
         data = f"grant_type=password&username={self.username}&password={self.password}"
 
         try:
-            response = self.session.post("https://api.climatixic.com/Token", headers=self.headers, data=data)
+            response = self.session.post(self.TOKEN_PATH, headers=self.headers, data=data)
             #out = json.loads(response.text)
             out = response.json()
 
@@ -279,7 +279,7 @@ class FlexitGo:
     def getPlant(self):
         out = dict()
         try:
-            response = self.session.get("https://api.climatixic.com/Plants", headers=self.headers)
+            response = self.session.get(self.PLANTS_PATH, headers=self.headers)
             out = response.json()
 
             for d in out["items"]:
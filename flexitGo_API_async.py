@@ -2,15 +2,188 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
+import sys
+import time
 import urllib.parse
+from array import array
+from collections.abc import Mapping
+from datetime import datetime
+from zoneinfo import ZoneInfo
 
-import arrow
 import structlog
 import ujson
+from yarl import URL
 
 from API.apihandlers import APIFlexitgo
 
 
+class DatapointRegistry:
+
+    def __init__(self, plantId, datapoints, datapointsPath):
+        self.plantId = plantId
+        self.datapoints = datapoints
+        self.keys = {path: sys.intern(f"{plantId}{path}") for path in datapoints}
+        self.putUrls = {path: f"{datapointsPath}/{urllib.parse.quote(key)}" for path, key in self.keys.items()}
+        self.filterIds = {}
+
+    def key(self, path):
+        key = self.keys.get(path)
+        if key is None:
+            key = self.keys[path] = sys.intern(f"{self.plantId}{path}")
+        return key
+
+    def filterId(self, paths):
+        # serialiseras en gång per unik uppsättning datapunkter
+        paths = tuple(paths)
+        filterId = self.filterIds.get(paths)
+        if filterId is None:
+            filterId = self.filterIds[paths] = ujson.dumps([{"DataPoints": self.key(path)} for path in paths], separators=(",", ":"))
+        return filterId
+
+    def decode(self, values, path):
+        group, kind = self.datapoints[path]
+        value = values[self.keys[path]]["value"]
+        if group == "sensor":
+            value = value["value"]
+
+        if kind == "float":
+            return round(float(value), 1)
+        elif kind == "int":
+            return int(value)
+        elif kind == "bool":
+            return bool(value)
+        return value
+
+
+class Subscription:
+    log = structlog.get_logger(__name__)
+
+    QUEUE_SIZE = 100
+
+    def __init__(self, paths, callback=None, deadbands=None):
+        self.paths = list(paths)
+        self.callback = callback
+        self.deadbands = deadbands or {}
+        self.last = {}
+        self.queue = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+
+    def _changes(self, values):
+        changes = {}
+        for path in self.paths:
+            if path not in values:
+                continue
+            value = values[path]
+            if path not in self.last:
+                changes[path] = value
+                continue
+
+            old = self.last[path]
+            deadband = self.deadbands.get(path, 0)
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and isinstance(old, (int, float)):
+                if abs(value - old) > deadband:
+                    changes[path] = value
+            elif value != old:
+                changes[path] = value
+
+        self.last.update(changes)
+        return changes
+
+    async def _deliver(self, changes):
+        if self.callback is not None:
+            try:
+                await self.callback(changes)
+            except Exception as e:
+                self.log.error("Exception in subscription callback", error=e)
+            return
+
+        # långsam läsare: släng äldsta ändringen hellre än att låta kön växa
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(changes)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.queue.get()
+
+
+class PollScheduler:
+
+    # intervallet halveras när en grupp ändrats, annars växer det med GROWTH upp till maxInterval
+    GROWTH = 1.25
+    LOW_BUDGET = 0.5
+
+    def __init__(self, groups, minInterval, maxInterval, rateLimiter=None, boostDuration=120):
+        self.groups = dict(groups)  # {grupp: ([paths], tröskel)}, paths utanför grupperna hamnar i "other"
+        self.groups.setdefault("other", ([], 0))
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.rateLimiter = rateLimiter
+        self.boostDuration = boostDuration
+        self.intervals = {group: minInterval for group in self.groups}
+        self.nextDue = {group: 0 for group in self.groups}
+        self.last = {group: {} for group in self.groups}
+        self.boostUntil = 0
+        # väcker pollslingan så att en boost inte behöver vänta ut en redan påbörjad lång sömn
+        self.wakeup = asyncio.Event()
+
+    def groupOf(self, path):
+        for group, (paths, threshold) in self.groups.items():
+            if path in paths:
+                return group
+        return "other"
+
+    def due(self, now=None):
+        now = time.monotonic() if now is None else now
+        return [group for group, nextDue in self.nextDue.items() if nextDue <= now]
+
+    def _budgetFactor(self):
+        if self.rateLimiter is None:
+            return 1.0
+        budget = self.rateLimiter.budget()
+        return 1.0 if budget >= self.LOW_BUDGET else self.LOW_BUDGET / max(budget, 0.05)
+
+    def interval(self, group, now=None):
+        now = time.monotonic() if now is None else now
+        if now < self.boostUntil:
+            return self.minInterval
+        return min(self.maxInterval, self.intervals[group] * self._budgetFactor())
+
+    def observe(self, group, values, now=None):
+        # values är gruppens nyss lästa {path: värde}, tom om läsningen misslyckades
+        now = time.monotonic() if now is None else now
+        threshold = self.groups[group][1]
+        last = self.last[group]
+        changed = False
+        for path, value in values.items():
+            old = last.get(path)
+            if old is not None and (abs(value - old) > threshold if isinstance(value, (int, float)) and not isinstance(value, bool) else value != old):
+                changed = True
+            last[path] = value
+
+        if changed:
+            self.intervals[group] = max(self.minInterval, self.intervals[group] / 2)
+        else:
+            self.intervals[group] = min(self.maxInterval, self.intervals[group] * self.GROWTH)
+        self.nextDue[group] = now + self.interval(group, now)
+
+    def boost(self, now=None):
+        # efter en skrivning pollas alla grupper tätt en stund
+        now = time.monotonic() if now is None else now
+        self.boostUntil = now + self.boostDuration
+        for group in self.nextDue:
+            self.nextDue[group] = min(self.nextDue[group], now + self.minInterval)
+        self.wakeup.set()
+
+    def boosted(self, now=None):
+        return (time.monotonic() if now is None else now) < self.boostUntil
+
+    def sleepTime(self, now=None):
+        now = time.monotonic() if now is None else now
+        return max(0.0, min(self.nextDue.values(), default=now + self.maxInterval) - now)
+
+
 class FlexitGo:
     log = structlog.get_logger(__name__)
     
@@ -69,40 +242,84 @@ class FlexitGo:
     BACNET_MAC_PATH = ";0!108000000001313"
     DEVICE_FEATURES_PATH = ";0!0083FFFFF0013F4"
 
-    SENSOR_DATA_PATH_LIST = [MODE_PATH,
-                             MODE_HOME_HIGH_CAL_PUT_PATH,
-                             OUTSIDE_AIR_TEMPERATURE_PATH,
-                             SUPPLY_AIR_TEMPERATURE_PATH,
-                             EXTRACT_AIR_TEMPERATURE_PATH,
-                             EXHAUST_AIR_TEMPERATURE_PATH,
-                             HOME_AIR_TEMPERATURE_PATH,
-                             AWAY_AIR_TEMPERATURE_PATH,
-                             ROOM_TEMPERATURE_PATH,
-                             FILTER_OPERATING_TIME_PATH,
-                             FILTER_TIME_FOR_EXCHANGE_PATH,
-                             HEATER_PATH,
-                             HEAT_EXCHANGER_SPEED_PATH,
-                             SUPPLY_FAN_SPEED_PATH,
-                             SUPPLY_FAN_CONTROL_SIGNAL_PATH,
-                             EXTRACT_FAN_SPEED_PATH,
-                             EXTRACT_FAN_CONTROL_SIGNAL_PATH,
-                             ADDITIONAL_HEATER_PATH,
-                             ALARM_CODE_A_PATH,
-                             ALARM_CODE_B_PATH,
-                             BOOST_DURATION_PATH,
-                             FIREPLACE_DURATION_PATH,
-                             AWAY_DELAY_PATH,
-                             CALENDAR_TEMPORARY_OVERRIDE_PATH]
-
-    DEVICE_INFO_PATH_LIST = [APPLICATION_SOFTWARE_VERSION_PATH,
-                             DEVICE_DESCRIPTION_PATH,
-                             MODEL_NAME_PATH,
-                             MODEL_INFORMATION_PATH,
-                             SERIAL_NUMBER_PATH,
-                             FIRMWARE_REVISION_PATH,
-                             OFFLINE_ONLINE_PATH,
-                             SYSTEM_STATUS_PATH,
-                             LAST_RESTART_REASON_PATH]
+    # path: (grupp, typ), grupp "sensor" läses av getSensors, "device" av getDevice
+    DATAPOINTS = {MODE_PATH: ("sensor", "int"),
+                  MODE_HOME_HIGH_CAL_PUT_PATH: ("sensor", "int"),
+                  OUTSIDE_AIR_TEMPERATURE_PATH: ("sensor", "float"),
+                  SUPPLY_AIR_TEMPERATURE_PATH: ("sensor", "float"),
+                  EXTRACT_AIR_TEMPERATURE_PATH: ("sensor", "float"),
+                  EXHAUST_AIR_TEMPERATURE_PATH: ("sensor", "float"),
+                  HOME_AIR_TEMPERATURE_PATH: ("sensor", "float"),
+                  AWAY_AIR_TEMPERATURE_PATH: ("sensor", "float"),
+                  ROOM_TEMPERATURE_PATH: ("sensor", "float"),
+                  FILTER_OPERATING_TIME_PATH: ("sensor", "int"),
+                  FILTER_TIME_FOR_EXCHANGE_PATH: ("sensor", "int"),
+                  HEATER_PATH: ("sensor", "bool"),
+                  HEAT_EXCHANGER_SPEED_PATH: ("sensor", "int"),
+                  SUPPLY_FAN_SPEED_PATH: ("sensor", "int"),
+                  SUPPLY_FAN_CONTROL_SIGNAL_PATH: ("sensor", "float"),
+                  EXTRACT_FAN_SPEED_PATH: ("sensor", "int"),
+                  EXTRACT_FAN_CONTROL_SIGNAL_PATH: ("sensor", "float"),
+                  ADDITIONAL_HEATER_PATH: ("sensor", "bool"),
+                  ALARM_CODE_A_PATH: ("sensor", "int"),
+                  ALARM_CODE_B_PATH: ("sensor", "int"),
+                  BOOST_DURATION_PATH: ("sensor", "int"),
+                  FIREPLACE_DURATION_PATH: ("sensor", "int"),
+                  AWAY_DELAY_PATH: ("sensor", "int"),
+                  CALENDAR_TEMPORARY_OVERRIDE_PATH: ("sensor", "bool"),
+
+                  APPLICATION_SOFTWARE_VERSION_PATH: ("device", "str"),
+                  DEVICE_DESCRIPTION_PATH: ("device", "str"),
+                  MODEL_NAME_PATH: ("device", "str"),
+                  MODEL_INFORMATION_PATH: ("device", "str"),
+                  SERIAL_NUMBER_PATH: ("device", "str"),
+                  FIRMWARE_REVISION_PATH: ("device", "str"),
+                  OFFLINE_ONLINE_PATH: ("device", "str"),
+                  SYSTEM_STATUS_PATH: ("device", "str"),
+                  LAST_RESTART_REASON_PATH: ("device", "int"),
+
+                  MODE_AWAY_PUT_PATH: ("put", "int"),
+                  MODE_HIGH_TEMP_PUT_PATH: ("put", "int"),
+                  MODE_FIREPLACE_PUT_PATH: ("put", "int"),
+
+                  CURRENT_FIREPLACE_DURATION_PATH: ("other", "int"),
+                  CURRENT_BOOST_DURATION_PATH: ("other", "int"),
+                  BACNET_MAC_PATH: ("other", "str"),
+                  DEVICE_FEATURES_PATH: ("other", "str")}
+
+    SENSOR_DATA_PATH_LIST = [path for path, (group, kind) in DATAPOINTS.items() if group == "sensor"]
+    DEVICE_INFO_PATH_LIST = [path for path, (group, kind) in DATAPOINTS.items() if group == "device"]
+
+    MODE_PUT_PATH_LIST = [MODE_AWAY_PUT_PATH,
+                          MODE_HOME_HIGH_CAL_PUT_PATH,
+                          MODE_HIGH_TEMP_PUT_PATH,
+                          MODE_FIREPLACE_PUT_PATH]
+
+    # sekunder en läst datapunkt får återanvändas, DEFAULT_TTL för allt som inte står här
+    DEFAULT_TTL = 10
+    PATH_TTL = {**{path: 6*60*60 for path in DEVICE_INFO_PATH_LIST},
+                OFFLINE_ONLINE_PATH: 60,
+                SYSTEM_STATUS_PATH: 60,
+                HOME_AIR_TEMPERATURE_PATH: 5*60,
+                AWAY_AIR_TEMPERATURE_PATH: 5*60,
+                BOOST_DURATION_PATH: 5*60,
+                FIREPLACE_DURATION_PATH: 5*60,
+                AWAY_DELAY_PATH: 5*60,
+                HEATER_PATH: 5*60,
+                FILTER_TIME_FOR_EXCHANGE_PATH: 60*60,
+                FILTER_OPERATING_TIME_PATH: 10*60}
+
+    # grupper för adaptiv pollning: ([paths], minsta ändring som räknas)
+    POLL_GROUPS = {"temps": ([OUTSIDE_AIR_TEMPERATURE_PATH, SUPPLY_AIR_TEMPERATURE_PATH, EXTRACT_AIR_TEMPERATURE_PATH,
+                              EXHAUST_AIR_TEMPERATURE_PATH, ROOM_TEMPERATURE_PATH], 0.2),
+                   "fans": ([HEAT_EXCHANGER_SPEED_PATH, SUPPLY_FAN_SPEED_PATH, SUPPLY_FAN_CONTROL_SIGNAL_PATH,
+                             EXTRACT_FAN_SPEED_PATH, EXTRACT_FAN_CONTROL_SIGNAL_PATH, HEATER_PATH, ADDITIONAL_HEATER_PATH], 5),
+                   "modes": ([MODE_PATH, MODE_HOME_HIGH_CAL_PUT_PATH, CALENDAR_TEMPORARY_OVERRIDE_PATH], 0),
+                   "alarm": ([ALARM_CODE_A_PATH, ALARM_CODE_B_PATH], 0),
+                   "setpoints": ([HOME_AIR_TEMPERATURE_PATH, AWAY_AIR_TEMPERATURE_PATH, BOOST_DURATION_PATH,
+                                  FIREPLACE_DURATION_PATH, AWAY_DELAY_PATH], 0),
+                   "filter": ([FILTER_OPERATING_TIME_PATH, FILTER_TIME_FOR_EXCHANGE_PATH], 24),
+                   "device": (DEVICE_INFO_PATH_LIST, 0)}
 
     mode = {0: "Null",
             1: "OFF",
@@ -112,43 +329,73 @@ class FlexitGo:
             5: "COOKER_HOOD",
             6: "FIREPLACE",
             7: "HIGH_DELAYED"}
+    modeIds = {name: modeInt for modeInt, name in mode.items()}
 
     TOKEN_PATH = "/Token"
     PLANTS_PATH = "/Plants"
     DATAPOINTS_PATH = "/DataPoints"
     # FILTER_PATH = f"{DATAPOINTS_PATH}/Values?filterId="
     VALUES_PATH = f"{DATAPOINTS_PATH}/Values"
+    # filterId delas upp så att varje anrop håller sig under gränsen räknat på URL:en som aiohttp/yarl faktiskt skickar,
+    # APIM tar längre men aiohttp, nginx m.fl. avvisar request-rader över 8 KB så gränsen hålls under det
+    MAX_URL_LENGTH = 8000
     plantId = None
+    plantIds = []
+    fleet = {}
+    # False släpper sensorData när det avkodats, men det är bara en dict runt samma poster som valueCache redan håller
+    # för TTL:erna, så det sparar nästan inget minne så länge cachen används
+    keepSensorData = True
+    POLL_INTERVAL = 30
+    MIN_POLL_INTERVAL = 10
+    MAX_POLL_INTERVAL = 300
+    # sekunder som skrivningar till samma datapunkt samlas innan de skickas, 0 stänger av
+    WRITE_COALESCE_WINDOW = 0.1
+    # under så här liten skillnad mellan frånluft och uteluft blir verkningsgraden bara brus
+    MIN_DELTA_T = 0.5
 
     def __init__(self):
-        pass
+        self.valueCache = {}
+        self._registry = None
+        self.subscriptions = []
+        self.pollTask = None
+        self.pollScheduler = None
+        self.pendingWrites = {}  # path: omgången som samlar skrivningar
+        self.writeTasks = {}  # path: senaste omgångens task, kvar tills dess PUT är klar
+        # t.ex. SensorRecorder från flexitGo_recorder och SensorDownsampler från flexitGo_downsampler, får varje avkodad getSensors
+        self.recorder = None
+        self.downsampler = None
 
     @classmethod
-    async def create(cls, username, password, commonSession=None):
+    async def create(cls, username, password, commonSession=None, lazy=False, **handlerParams):
+        # handlerParams skriver över standardvärdena för APIFlexitgo, t.ex. BASE_URL eller RETRY_DELAY mot en lokal testserver
+        # lazy=True gör varken login eller getPlant här, det sker vid första anropet
         try:
             if cls.fg is None:
                 cls.fg = cls()
                 if cls.apiHandler is None:
-                    cls.apiHandler = await APIFlexitgo.create(name="FlexitGo",
-                                                              commonSession=commonSession,
-                                                              tokenFileName="/home/staffan/olis/olis_flexit/tokenfile.txt",
-                                                              lastSessionFileName="/home/staffan/olis/olis_flexit/lastsessionfile.txt",
-                                                              headers={"Accept": "application/json",
-                                                                       "Accept-Encoding": "gzip, deflate, br",
-                                                                       "Accept-Language": "en-us",
-                                                                       "Content-Type": "application/json; charset=utf-8",
-                                                                       "User-Agent": "Flexit%20GO/2.0.6 CFNetwork/1128.0.1 Darwin/19.6.0",
-                                                                       "Ocp-Apim-Subscription-Key": "c3fc1f14ce8747588212eda5ae3b439e",
-                                                                       "Host": "api.climatixic.com"},
-                                                              data=f"grant_type=password&username={username}&password={password}".encode("ASCII"),
-                                                              loginUrls=[cls.TOKEN_PATH],
-                                                              BASE_URL="https://api.climatixic.com",
-                                                              RETRIES=3,
-                                                              RETRY_DELAY=300,
-                                                              THROTTLE_DELAY=0,
-                                                              THROTTLE_ERROR_DELAY=3*60*60)
-
-                    await cls.fg.getPlant()
+                    params = {"name": "FlexitGo",
+                              "commonSession": commonSession,
+                              "tokenFileName": "/home/staffan/olis/olis_flexit/tokenfile.txt",
+                              "lastSessionFileName": "/home/staffan/olis/olis_flexit/lastsessionfile.txt",
+                              "headers": {"Accept": "application/json",
+                                          "Accept-Encoding": "gzip, deflate, br",
+                                          "Accept-Language": "en-us",
+                                          "Content-Type": "application/json; charset=utf-8",
+                                          "User-Agent": "Flexit%20GO/2.0.6 CFNetwork/1128.0.1 Darwin/19.6.0",
+                                          "Ocp-Apim-Subscription-Key": "c3fc1f14ce8747588212eda5ae3b439e",
+                                          "Host": "api.climatixic.com"},
+                              "data": f"grant_type=password&username={username}&password={password}".encode("ASCII"),
+                              "loginUrls": [cls.TOKEN_PATH],
+                              "BASE_URL": "https://api.climatixic.com",
+                              "RETRIES": 3,
+                              "RETRY_DELAY": 300,
+                              "THROTTLE_DELAY": 0,
+                              "THROTTLE_ERROR_DELAY": 3*60*60}
+                    params.update(handlerParams)
+                    cls.apiHandler = await APIFlexitgo.create(lazy=lazy, **params)
+
+                    if not lazy:
+                        await cls.fg.getPlant()
             return cls.fg
 
         except Exception as e:
@@ -158,8 +405,14 @@ class FlexitGo:
     async def logout(self):
         await self.apiHandler.logout()
 
+    @property
+    def registry(self):
+        if self._registry is None or self._registry.plantId != self.plantId:
+            self._registry = DatapointRegistry(self.plantId, self.DATAPOINTS, self.DATAPOINTS_PATH)
+        return self._registry
+
     def _path(self, path):
-        return f"{self.plantId}{path}"
+        return self.registry.key(path)
 
     def _escaped_filter_url(self, path):
         return f"{self.FILTER_PATH}{urllib.parse.quote(path)}"
@@ -170,54 +423,66 @@ class FlexitGo:
     #        url += f"""{{"DataPoints":"{self._path(path)}"}}{ "," if path != paths[-1] else "]"}"""
     #    return url
 
-    def _create_url_from_paths2(self, paths):
-        url = list()
+    def _cacheValues(self, values, paths, now=None):
+        now = time.monotonic() if now is None else now
         for path in paths:
-            sub = {"DataPoints": self._path(path)}
-            url.append(sub)
-        return url
+            key = self._path(path)
+            if key in values:
+                self.valueCache[key] = (now + self.PATH_TTL.get(path, self.DEFAULT_TTL), values[key])
+
+    async def _readValues(self, paths):
+        now = time.monotonic()
+        stale = [path for path in paths if self.valueCache.get(self._path(path), (0, None))[0] <= now]
+
+        if stale:
+            params = {"filterId": self.registry.filterId(stale)}
+            result = await self.apiHandler.doSession(method="GET", url=self.VALUES_PATH, params=params)
+            if result is None:
+                # under ett avbrott hellre gamla värden än inga, så länge alla finns i cachen
+                if not self.apiHandler.upstreamUnavailable() or any(self._path(path) not in self.valueCache for path in paths):
+                    return None
+                self.log.info("Serving cached values while upstream is unavailable", stale=len(stale))
+            else:
+                self._cacheValues(result.get("values", {}), stale, now)
+
+        return {"values": {self._path(path): self.valueCache[self._path(path)][1] for path in paths if self._path(path) in self.valueCache}}
+
+    def invalidate(self, path=None):
+        if path is None:
+            self.valueCache.clear()
+        else:
+            self.valueCache.pop(self._path(path), None)
 
     def _escaped_datapoints_url(self, path):
         return f"{self.DATAPOINTS_PATH}/{urllib.parse.quote(path)}"
 
-    def _str_device(self, path):
-        return self.deviceData["values"][f"{self.plantId}{path}"]['value']
+    def _sensor(self, path):
+        return self.registry.decode(self.sensorData["values"], path)
 
-    def _str_sensor(self, path):
-        return self.sensorData["values"][f"{self.plantId}{path}"]['value']['value']
+    def _device(self, path):
+        return self.registry.decode(self.deviceData["values"], path)
 
     def _present_priority(self, path):
-        return self.sensorData["values"][f"{self.plantId}{path}"]['value']["presentPriority"]
-
-    def _int_device(self, path):
-        return int(self._str_device(path))
-
-    def _int_sensor(self, path):
-        return int(self._str_sensor(path))
-
-    def _bool_sensor(self, path):
-        return bool(self._str_sensor(path))
-
-    def _float_sensor(self, path):
-        return round(float(self._str_sensor(path)), 1)
+        return self.sensorData["values"][self._path(path)]['value']["presentPriority"]
 
     def _calendar_active(self, path):
         return self._present_priority(path) == 15
 
-    @staticmethod
-    def _dirty_filter(filter_time_for_exchange):
-        return arrow.get(filter_time_for_exchange) < arrow.now()
-
     @classmethod
     def _ventilation_mode(cls, ventilation_int):
         return cls.mode.get(ventilation_int, f"Unknown mode: {str(ventilation_int)}")
 
-    @staticmethod
-    def _to_efficiency(tilluft, uteluft, frånluft):
+    @classmethod
+    def _to_efficiency(cls, tilluft, uteluft, frånluft):
+        # utan temperaturskillnad finns ingen verkningsgrad att räkna
+        if abs(frånluft - uteluft) < cls.MIN_DELTA_T:
+            return None
         return round(((tilluft - uteluft) / (frånluft - uteluft)) * 100, 1)
 
-    @staticmethod
-    def _from_efficiency(uteluft, frånluft, avluft):
+    @classmethod
+    def _from_efficiency(cls, uteluft, frånluft, avluft):
+        if abs(frånluft - uteluft) < cls.MIN_DELTA_T:
+            return None
         return round(((frånluft - avluft) / (frånluft - uteluft)) * 100, 1)
 
     @classmethod
@@ -225,112 +490,320 @@ class FlexitGo:
         out = {}
         try:
             out = await cls.apiHandler.doSession(method="GET", url=cls.PLANTS_PATH)
-            for d in out["items"]:
-                cls.plantId = d["id"]
+            cls.plantIds = [d["id"] for d in out["items"]]
+            if cls.plantIds:
+                cls.plantId = cls.plantIds[-1]
 
         except Exception as e:
             cls.log.error("Exception in getPlant",  error=e, out=out)
 
         return out
 
+    def forPlant(self, plantId):
+        # egen instans per anläggning, apiHandler (session, token och rate limit) delas via klassen
+        if plantId not in self.fleet:
+            plant = type(self)()
+            plant.plantId = plantId
+            self.fleet[plantId] = plant
+        return self.fleet[plantId]
+
+    @staticmethod
+    def _encodedLength(text):
+        # yarl kodar tecken för tecken, så längden på delarna går att summera
+        return len(URL.build(query={"f": text}).raw_query_string) - 2
+
+    def _batched_filter_params(self, keys, maxUrlLength=None):
+        # lägger datapunkter från flera anläggningar i samma filterId, så få anrop som URL-längden tillåter
+        base = len(str((self.apiHandler.BASE_URL or URL("")).join(URL(self.VALUES_PATH)).with_query(filterId="[]")))
+        comma = self._encodedLength(",")
+        maxUrlLength = maxUrlLength or self.MAX_URL_LENGTH
+        batches = list()
+        batch = list()
+        length = base
+        for key in keys:
+            sub = {"DataPoints": key}
+            subLength = self._encodedLength(ujson.dumps(sub, separators=(",", ":"))) + (comma if batch else 0)
+            if batch and length + subLength > maxUrlLength:
+                batches.append(batch)
+                batch = list()
+                length = base
+                subLength -= comma
+            batch.append(sub)
+            length += subLength
+        if batch:
+            batches.append(batch)
+
+        return [{"filterId": ujson.dumps(batch, separators=(",", ":"))} for batch in batches]
+
+    async def _getFleetSensorsBatched(self, maxConcurrency, maxUrlLength):
+        semaphore = asyncio.Semaphore(maxConcurrency)
+
+        async def _fetch(params):
+            async with semaphore:
+                return await self.apiHandler.doSession(method="GET", url=self.VALUES_PATH, params=params)
+
+        # bara det som gått ut i respektive anläggnings cache hämtas, samma TTL:er som getSensors
+        now = time.monotonic()
+        plants = [self.forPlant(plantId) for plantId in self.plantIds]
+        stale = {plant.plantId: [path for path in self.SENSOR_DATA_PATH_LIST if plant.valueCache.get(plant._path(path), (0, None))[0] <= now] for plant in plants}
+
+        values = {}
+        for result in await asyncio.gather(*[_fetch(params) for params in self._batched_filter_params([plant._path(path) for plant in plants for path in stale[plant.plantId]], maxUrlLength)]):
+            if result is not None:
+                values.update(result.get("values", {}))
+
+        timestamp = time.time()
+        out = {}
+        for plant in plants:
+            plant._cacheValues(values, stale[plant.plantId], now)
+            out[plant.plantId] = {}
+            if any(plant._path(path) not in values for path in stale[plant.plantId]):
+                # som i _readValues, gamla värden bara när API:t inte går att nå och allt finns i cachen
+                if not self.apiHandler.upstreamUnavailable() or any(plant._path(path) not in plant.valueCache for path in self.SENSOR_DATA_PATH_LIST):
+                    continue
+                self.log.info("Serving cached values while upstream is unavailable", plantId=plant.plantId)
+            try:
+                plant.sensorData = {"values": {plant._path(path): plant.valueCache[plant._path(path)][1] for path in self.SENSOR_DATA_PATH_LIST}}
+                out[plant.plantId].update(plant._publishSensors(timestamp).asDict())
+
+            except Exception as e:
+                self.log.error("Exception in getFleetSensors", error=e, plantId=plant.plantId, out=out[plant.plantId])
+
+        return out
+
+    async def getFleetSensors(self, maxConcurrency=4, batched=False, maxUrlLength=None):
+        # maxUrlLength skriver över MAX_URL_LENGTH för batched, t.ex. bakom en proxy med kortare gräns
+        if not self.plantIds:
+            await self.getPlant()
+
+        if batched:
+            return await self._getFleetSensorsBatched(maxConcurrency, maxUrlLength)
+
+        semaphore = asyncio.Semaphore(maxConcurrency)
+
+        async def _poll(plantId):
+            async with semaphore:
+                return plantId, await self.forPlant(plantId).getSensors()
+
+        return dict(await asyncio.gather(*[_poll(plantId) for plantId in self.plantIds]))
+
     async def getDevice(self):
         if self.plantId is None:
             await self.getPlant()
             
-        # url = self._escaped_filter_url(self._create_url_from_paths(self.DEVICE_INFO_PATH_LIST))
-        paramlist = await self._create_url_from_paths2(self.DEVICE_INFO_PATH_LIST)
-        params = {"filterId": ujson.dumps(paramlist, separators=(",", ":"))}
+        out = {}
 
         try:
-            self.deviceData = await self.apiHandler.doSession(method="GET", url=self.VALUES_PATH, params=params)
+            self.deviceData = await self._readValues(self.DEVICE_INFO_PATH_LIST)
 
             # pprint(self.deviceData)
 
-            out = {"fw": self._str_device(self.FIRMWARE_REVISION_PATH),
-                   "modelName": self._str_device(self.MODEL_NAME_PATH),
-                   "modelInfo": self._str_device(self.MODEL_INFORMATION_PATH),
-                   "serialInfo": self._str_device(self.SERIAL_NUMBER_PATH),
-                   "systemStatus": self._str_device(self.SYSTEM_STATUS_PATH),
-                   "status": self._str_device(self.OFFLINE_ONLINE_PATH),
-                   "deviceDescription": self._str_device(self.DEVICE_DESCRIPTION_PATH),
-                   "applicationSoftwareVersion": self._str_device(self.APPLICATION_SOFTWARE_VERSION_PATH),
-                   "lastRestartReason": self._int_device(self.LAST_RESTART_REASON_PATH)}
+            out = {"fw": self._device(self.FIRMWARE_REVISION_PATH),
+                   "modelName": self._device(self.MODEL_NAME_PATH),
+                   "modelInfo": self._device(self.MODEL_INFORMATION_PATH),
+                   "serialInfo": self._device(self.SERIAL_NUMBER_PATH),
+                   "systemStatus": self._device(self.SYSTEM_STATUS_PATH),
+                   "status": self._device(self.OFFLINE_ONLINE_PATH),
+                   "deviceDescription": self._device(self.DEVICE_DESCRIPTION_PATH),
+                   "applicationSoftwareVersion": self._device(self.APPLICATION_SOFTWARE_VERSION_PATH),
+                   "lastRestartReason": self._device(self.LAST_RESTART_REASON_PATH)}
 
         except Exception as e:
             self.log.error("Exception in getDevice",  error=e, out=out)
 
         return out
 
-    async def getSensors(self):
+    def subscribe(self, paths, callback=None, deadbands=None, interval=None, adaptive=False):
+        # callback är en coroutine som får {path: värde} med bara ändrade värden, utan callback itereras subscriptionen med async for
+        known = [path for path in paths if path in self.DATAPOINTS]
+        if len(known) != len(paths):
+            self.log.warning("Ignoring unknown datapoints in subscribe", paths=[path for path in paths if path not in self.DATAPOINTS])
+
+        subscription = Subscription(known, callback, deadbands)
+        self.subscriptions.append(subscription)
+        self.startPolling(interval, adaptive)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        if subscription in self.subscriptions:
+            self.subscriptions.remove(subscription)
+
+    def startPolling(self, interval=None, adaptive=False):
+        # adaptive=True låter varje grupp i POLL_GROUPS få sitt eget intervall mellan MIN_ och MAX_POLL_INTERVAL
+        if interval is not None:
+            self.POLL_INTERVAL = interval
+        if self.pollScheduler is None or interval is not None or adaptive:
+            if adaptive:
+                self.pollScheduler = PollScheduler(self.POLL_GROUPS, self.MIN_POLL_INTERVAL, self.MAX_POLL_INTERVAL,
+                                                   rateLimiter=self.apiHandler.rateLimiter if self.apiHandler else None)
+            else:
+                self.pollScheduler = PollScheduler(self.POLL_GROUPS, self.POLL_INTERVAL, self.POLL_INTERVAL)
+        if self.pollTask is None or self.pollTask.done():
+            self.pollTask = asyncio.get_running_loop().create_task(self._pollLoop())
+
+    async def stopPolling(self):
+        if self.pollTask is not None and not self.pollTask.done():
+            self.pollTask.cancel()
+            await asyncio.gather(self.pollTask, return_exceptions=True)
+        self.pollTask = None
+
+    async def pollOnce(self, groups=None):
+        if self.plantId is None:
+            await self.getPlant()
+
+        paths = list(dict.fromkeys(path for subscription in self.subscriptions for path in subscription.paths))
+        if groups is not None:
+            paths = [path for path in paths if self.pollScheduler.groupOf(path) in groups]
+
+        # under en boost får PATH_TTL inte dölja de tätare pollningarna
+        if self.pollScheduler is not None and self.pollScheduler.boosted():
+            for path in paths:
+                self.invalidate(path)
+
+        values = {}
+        data = await self._readValues(paths) if paths else None
+        if data is not None:
+            for path in paths:
+                try:
+                    values[path] = self.registry.decode(data["values"], path)
+                except (KeyError, TypeError, ValueError):
+                    pass
+
+        if self.pollScheduler is not None:
+            for group in groups if groups is not None else self.pollScheduler.groups:
+                self.pollScheduler.observe(group, {path: value for path, value in values.items() if self.pollScheduler.groupOf(path) == group})
+
+        if not values:
+            return
+
+        for subscription in list(self.subscriptions):
+            changes = subscription._changes(values)
+            if changes:
+                await subscription._deliver(changes)
+
+    async def _pollLoop(self):
+        # en gemensam poll för alla prenumeranter, bara de grupper som står på tur läses
+        while self.subscriptions:
+            try:
+                due = self.pollScheduler.due()
+                if due:
+                    await self.pollOnce(due)
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception as e:
+                self.log.error("Exception in _pollLoop", error=e)
+
+            try:
+                await asyncio.wait_for(self.pollScheduler.wakeup.wait(), self.pollScheduler.sleepTime())
+            except asyncio.TimeoutError:
+                pass
+            self.pollScheduler.wakeup.clear()
+
+    async def getSensors(self, snapshot=False):
+        # snapshot=True ger en kompakt SensorSnapshot istället för nästlade dicts
         if self.plantId is None:
             await self.getPlant()
             
         # await self.apiHandler._validateToken()
         out = {}
-        # url1 = self._escaped_filter_url(self._create_url_from_paths(self.SENSOR_DATA_PATH_LIST))
-        paramlist = self._create_url_from_paths2(self.SENSOR_DATA_PATH_LIST)
-        params = {"filterId": ujson.dumps(paramlist, separators=(",", ":"))}
-        now = arrow.now(self.TIME_ZONE)
+        now = time.time()
 
         try:
-            self.sensorData = await self.apiHandler.doSession(method="GET", url=self.VALUES_PATH, params=params)
-
-            out["temps"] = {"home_air_temperature": self._float_sensor(self.HOME_AIR_TEMPERATURE_PATH),
-                            "away_air_temperature": self._float_sensor(self.AWAY_AIR_TEMPERATURE_PATH),
-                            "Uteluft": self._float_sensor(self.OUTSIDE_AIR_TEMPERATURE_PATH),
-                            "Tilluft": self._float_sensor(self.SUPPLY_AIR_TEMPERATURE_PATH),
-                            "Avluft": self._float_sensor(self.EXHAUST_AIR_TEMPERATURE_PATH),
-                            "Frånluft": self._float_sensor(self.EXTRACT_AIR_TEMPERATURE_PATH),
-                            "room_temperature": self._float_sensor(self.ROOM_TEMPERATURE_PATH)}
-
-            out["temps"]["verkningsgrad_tilluft"] = self._to_efficiency(out["temps"]["Tilluft"], out["temps"]["Uteluft"], out["temps"]["Frånluft"])
-            out["temps"]["verkningsgrad_frånluft"] = self._from_efficiency(out["temps"]["Uteluft"], out["temps"]["Frånluft"], out["temps"]["Avluft"])
-
-            out["modes"] = {"electric_heater": self._bool_sensor(self.HEATER_PATH),
-                            "ventilation_mode": self._ventilation_mode(self._int_sensor(self.MODE_PATH)),
-                            "ventilation_mode_cal": self._ventilation_mode(self._int_sensor(self.MODE_HOME_HIGH_CAL_PUT_PATH)),
-                            "heat_exchanger_speed": self._int_sensor(self.HEAT_EXCHANGER_SPEED_PATH),
-                            "additional_heater": self._bool_sensor(self.ADDITIONAL_HEATER_PATH),
-                            "calendar_temporary_override": self._bool_sensor(self.CALENDAR_TEMPORARY_OVERRIDE_PATH),
-                            "calendar_active": self._calendar_active(self.MODE_HOME_HIGH_CAL_PUT_PATH),
-                            "boost_duration": self._int_sensor(self.BOOST_DURATION_PATH),
-                            "away_delay": self._int_sensor(self.AWAY_DELAY_PATH),
-                            "fireplace_duration": self._int_sensor(self.FIREPLACE_DURATION_PATH)}
-
-            out["fläkt"] = {"supply_fan_speed": self._int_sensor(self.SUPPLY_FAN_SPEED_PATH),
-                            "supply_fan_control_signal": self._float_sensor(self.SUPPLY_FAN_CONTROL_SIGNAL_PATH),
-                            "extract_fan_speed": self._int_sensor(self.EXTRACT_FAN_SPEED_PATH),
-                            "extract_fan_control_signal": self._float_sensor(self.EXTRACT_FAN_CONTROL_SIGNAL_PATH)}
-
-            out["alarm"] = {"alarm_code_a": self._int_sensor(self.ALARM_CODE_A_PATH),
-                            "alarm_code_b": self._int_sensor(self.ALARM_CODE_B_PATH)}
-
-            out["filter"] = {"filter_exchanged": now.shift(hours=-self._int_sensor(self.FILTER_OPERATING_TIME_PATH)).format("YYYY-MM-DD"),
-                             "filter_time_for_exchange": now.shift(hours=self._int_sensor(self.FILTER_TIME_FOR_EXCHANGE_PATH) - self._int_sensor(self.FILTER_OPERATING_TIME_PATH)).format("YYYY-MM-DD")}
-            out["filter"]["dirty_filter"] = self._dirty_filter(out["filter"]["filter_time_for_exchange"])
-
-            out["timestamp"] = now.format(self.DATE_FORMAT)
+            self.sensorData = await self._readValues(self.SENSOR_DATA_PATH_LIST)
+            _snapshot = self._publishSensors(now)
+            if snapshot:
+                return _snapshot
+            out.update(_snapshot.asDict())
 
         except Exception as e:
             self.log.error("Exception in getSensors",  error=e, out=out)
 
-        return out
+        return None if snapshot else out
+
+    def _decodeSnapshot(self, now):
+        values = array("d", (float(self._calendar_active(path)) if name == "calendar_active" else float(self._sensor(path)) for group, name, path in SensorSnapshot.FIELDS))
+        return SensorSnapshot(now, values)
+
+    def _publishSensors(self, now):
+        # avkodar sensorData och lämnar snapshoten till recorder/downsampler, gemensamt för getSensors och getFleetSensors
+        _snapshot = self._decodeSnapshot(now)
+        if self.recorder is not None:
+            self.recorder.record(_snapshot)
+        if self.downsampler is not None:
+            self.downsampler.add(_snapshot)
+        if not self.keepSensorData:
+            self.sensorData = None
+        return _snapshot
 
     async def setSensor(self, path, body):
+        # lägena är toggles, två skrivningar får aldrig slås ihop till en
+        if self.WRITE_COALESCE_WINDOW <= 0 or path in self.MODE_PUT_PATH_LIST:
+            return await self._putSensor(path, body)
+
+        # skrivningar till samma datapunkt inom fönstret blir en PUT med sista värdet, olika datapunkter skickas parallellt
+        loop = asyncio.get_running_loop()
+        pending = self.pendingWrites.get(path)
+        if pending is None:
+            pending = self.pendingWrites[path] = {"body": body, "waiters": []}
+            # en ny omgång väntar in föregående omgångs PUT så att ordningen mot servern behålls
+            task = loop.create_task(self._flushWrite(path, pending, self.writeTasks.get(path)))
+            self.writeTasks[path] = task
+            task.add_done_callback(lambda done: self.writeTasks.pop(path, None) if self.writeTasks.get(path) is done else None)
+        else:
+            pending["body"] = body
+
+        waiter = loop.create_future()
+        pending["waiters"].append(waiter)
+        return await waiter
+
+    async def _flushWrite(self, path, pending, previous):
+        result = False
+        try:
+            await asyncio.sleep(self.WRITE_COALESCE_WINDOW)
+            # skrivningar som kommer efter detta hamnar i en ny omgång
+            if self.pendingWrites.get(path) is pending:
+                del self.pendingWrites[path]
+            if previous is not None:
+                await asyncio.gather(previous, return_exceptions=True)
+            result = await self._putSensor(path, pending["body"])
+
+        finally:
+            if self.pendingWrites.get(path) is pending:
+                del self.pendingWrites[path]
+            for waiter in pending["waiters"]:
+                if not waiter.done():
+                    waiter.set_result(result)
+
+    async def flushWrites(self):
+        # väntar in alla skrivningar, både de som samlas och de som är på väg, t.ex. innan closeSession
+        while self.writeTasks:
+            await asyncio.gather(*list(self.writeTasks.values()), return_exceptions=True)
+
+    async def _putSensor(self, path, body):
         if self.plantId is None:
             await self.getPlant()
             
         # await self.apiHandler._validateToken()
         data_body = None if body is None else str(body)
-        _url = self._escaped_datapoints_url(self._path(path))
+        _url = self.registry.putUrls.get(path) or self._escaped_datapoints_url(self._path(path))
         data = ujson.dumps({"Value": data_body})
+        out = {}
 
         try:
             out = await self.apiHandler.doSession(method="PUT", url=_url, data=data)
+            # utan svar, t.ex. när kretsen är öppen, är cachen fortfarande giltig
+            if out is not None:
+                self.invalidate(path)
+                if path in self.MODE_PUT_PATH_LIST:
+                    self.invalidate(self.MODE_PATH)
+                if self.pollScheduler is not None:
+                    self.pollScheduler.boost()
             return out["stateTexts"][self._path(path)] == "Success"
 
         except Exception as e:
-            self.log.error("Exception in setSensor",  error=e, out=out)
+            self.log.error("Exception in _putSensor",  error=e, out=out)
             return False
 
     async def setHomeTemp(self, temp):
@@ -346,8 +819,17 @@ class FlexitGo:
             self.log.warning(f"{presetMode} are not a valid  mode!")
             return False
 
-        currentMode = await self.getSensors()
-        currentMode = currentMode["modes"]["ventilation_mode"]
+        # bara MODE_PATH behövs, och den tas från cachen om den är färsk nog
+        modeKey = self._path(self.MODE_PATH)
+        try:
+            data = await self._readValues([self.MODE_PATH])
+            modeEntry = data["values"][modeKey]
+            currentMode = self._ventilation_mode(int(modeEntry["value"]["value"]))
+
+        except Exception as e:
+            self.log.error("Exception in setPresetMode reading current mode", error=e)
+            return False
+
         result = list()
 
         if currentMode == presetMode:
@@ -366,6 +848,10 @@ class FlexitGo:
         # print(f"Flexitgo switching mode to {presetMode}")
         self.log.info(f"Flexitgo switching mode to {presetMode}")
 
+        # uppdatera cachen direkt istället för att läsa om, för lägen som inte har ett eget MODE_PATH-värde läses det om nästa gång
+        if all(result) and presetMode in self.modeIds:
+            self.valueCache[modeKey] = (time.monotonic() + self.DEFAULT_TTL, {**modeEntry, "value": {**modeEntry["value"], "value": self.modeIds[presetMode]}})
+
         return all(result)
 
     async def _setMode(self, mode):
@@ -402,3 +888,95 @@ class FlexitGo:
 
     async def setCalendarTemporaryOverride(self, value):
         return await self.setSensor(self.CALENDAR_TEMPORARY_OVERRIDE_PATH, value)
+
+
+class SensorSnapshot(Mapping):
+    # alla värden i en array("d") i fast ordning, dict-vyn byggs först när någon frågar efter den och sparas sedan
+    __slots__ = ("timestamp", "values", "_dict")
+
+    FIELDS = (("temps", "home_air_temperature", FlexitGo.HOME_AIR_TEMPERATURE_PATH),
+              ("temps", "away_air_temperature", FlexitGo.AWAY_AIR_TEMPERATURE_PATH),
+              ("temps", "Uteluft", FlexitGo.OUTSIDE_AIR_TEMPERATURE_PATH),
+              ("temps", "Tilluft", FlexitGo.SUPPLY_AIR_TEMPERATURE_PATH),
+              ("temps", "Avluft", FlexitGo.EXHAUST_AIR_TEMPERATURE_PATH),
+              ("temps", "Frånluft", FlexitGo.EXTRACT_AIR_TEMPERATURE_PATH),
+              ("temps", "room_temperature", FlexitGo.ROOM_TEMPERATURE_PATH),
+              ("modes", "electric_heater", FlexitGo.HEATER_PATH),
+              ("modes", "ventilation_mode", FlexitGo.MODE_PATH),
+              ("modes", "ventilation_mode_cal", FlexitGo.MODE_HOME_HIGH_CAL_PUT_PATH),
+              ("modes", "heat_exchanger_speed", FlexitGo.HEAT_EXCHANGER_SPEED_PATH),
+              ("modes", "additional_heater", FlexitGo.ADDITIONAL_HEATER_PATH),
+              ("modes", "calendar_temporary_override", FlexitGo.CALENDAR_TEMPORARY_OVERRIDE_PATH),
+              ("modes", "calendar_active", FlexitGo.MODE_HOME_HIGH_CAL_PUT_PATH),
+              ("modes", "boost_duration", FlexitGo.BOOST_DURATION_PATH),
+              ("modes", "away_delay", FlexitGo.AWAY_DELAY_PATH),
+              ("modes", "fireplace_duration", FlexitGo.FIREPLACE_DURATION_PATH),
+              ("fläkt", "supply_fan_speed", FlexitGo.SUPPLY_FAN_SPEED_PATH),
+              ("fläkt", "supply_fan_control_signal", FlexitGo.SUPPLY_FAN_CONTROL_SIGNAL_PATH),
+              ("fläkt", "extract_fan_speed", FlexitGo.EXTRACT_FAN_SPEED_PATH),
+              ("fläkt", "extract_fan_control_signal", FlexitGo.EXTRACT_FAN_CONTROL_SIGNAL_PATH),
+              ("alarm", "alarm_code_a", FlexitGo.ALARM_CODE_A_PATH),
+              ("alarm", "alarm_code_b", FlexitGo.ALARM_CODE_B_PATH),
+              ("filter", "filter_operating_time", FlexitGo.FILTER_OPERATING_TIME_PATH),
+              ("filter", "filter_time_for_exchange", FlexitGo.FILTER_TIME_FOR_EXCHANGE_PATH))
+
+    INDEX = {name: index for index, (group, name, path) in enumerate(FIELDS)}
+    TZ = ZoneInfo(FlexitGo.TIME_ZONE)
+    KEYS = ("temps", "modes", "fläkt", "alarm", "filter", "timestamp")
+
+    def __init__(self, timestamp, values):
+        self.timestamp = timestamp
+        self.values = values
+        self._dict = None
+
+    def field(self, name):
+        return self.values[self.INDEX[name]]
+
+    def _typed(self, name, path, value):
+        if name in ("ventilation_mode", "ventilation_mode_cal"):
+            return FlexitGo._ventilation_mode(int(value))
+        if name == "calendar_active":
+            return bool(value)
+
+        kind = FlexitGo.DATAPOINTS[path][1]
+        if kind == "int":
+            return int(value)
+        elif kind == "bool":
+            return bool(value)
+        return value
+
+    def asDict(self):
+        out = {"temps": {}, "modes": {}, "fläkt": {}, "alarm": {}}
+        for (group, name, path), value in zip(self.FIELDS, self.values):
+            if group != "filter":
+                out[group][name] = self._typed(name, path, value)
+
+        temps = out["temps"]
+        temps["verkningsgrad_tilluft"] = FlexitGo._to_efficiency(temps["Tilluft"], temps["Uteluft"], temps["Frånluft"])
+        temps["verkningsgrad_frånluft"] = FlexitGo._from_efficiency(temps["Uteluft"], temps["Frånluft"], temps["Avluft"])
+
+        # allt räknas i epoch-sekunder, tidszonen används bara när strängarna formateras
+        operatingTime = int(self.field("filter_operating_time"))
+        timeForExchange = int(self.field("filter_time_for_exchange"))
+        out["filter"] = {"filter_exchanged": datetime.fromtimestamp(self.timestamp - operatingTime * 3600, self.TZ).strftime("%Y-%m-%d"),
+                         "filter_time_for_exchange": datetime.fromtimestamp(self.timestamp + (timeForExchange - operatingTime) * 3600, self.TZ).strftime("%Y-%m-%d")}
+        # dirty_filter gäller dagen värdena lästes, i samma tidszon som datumen ovan
+        out["filter"]["dirty_filter"] = out["filter"]["filter_time_for_exchange"] <= datetime.fromtimestamp(self.timestamp, self.TZ).strftime("%Y-%m-%d")
+
+        out["timestamp"] = datetime.fromtimestamp(self.timestamp, self.TZ).strftime("%Y-%m-%d %H:%M:%S")
+        return out
+
+    def __getitem__(self, key):
+        # asDict ger en ny dict som anroparen får ändra i, Mapping-vyn återanvänder sin egen
+        if self._dict is None:
+            self._dict = self.asDict()
+        return self._dict[key]
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __repr__(self):
+        return f"SensorSnapshot({self.asDict()!r})"
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import structlog
+
+from API.flexitGo_API_async import FlexitGo
+
+
+class SensorAnalytics:
+    log = structlog.get_logger(__name__)
+
+    TZ = ZoneInfo(FlexitGo.TIME_ZONE)
+
+    MIN_DELTA_T = FlexitGo.MIN_DELTA_T
+    # längre uppehåll än så här mellan två värden räknas inte in i gradtimmarna
+    MAX_GAP = 60*60
+
+    COLUMNS = (FlexitGo.OUTSIDE_AIR_TEMPERATURE_PATH,
+               FlexitGo.SUPPLY_AIR_TEMPERATURE_PATH,
+               FlexitGo.EXTRACT_AIR_TEMPERATURE_PATH,
+               FlexitGo.EXHAUST_AIR_TEMPERATURE_PATH,
+               FlexitGo.ROOM_TEMPERATURE_PATH,
+               FlexitGo.SUPPLY_FAN_SPEED_PATH,
+               FlexitGo.EXTRACT_FAN_SPEED_PATH,
+               FlexitGo.FILTER_OPERATING_TIME_PATH,
+               FlexitGo.FILTER_TIME_FOR_EXCHANGE_PATH)
+
+    def __init__(self, timestamps, columns):
+        # timestamps i epoch-sekunder, columns är {path: värden} med NaN där värde saknas
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+        self.columns = {path: np.asarray(values, dtype=np.float64) for path, values in columns.items()}
+
+    @classmethod
+    def fromRecorder(cls, recorder, start=None, end=None, paths=None):
+        timestamps, columns = recorder.columnsBetween(start, end, paths or [path for path in cls.COLUMNS if path in recorder.index])
+        return cls(np.frombuffer(timestamps, dtype=np.float64), {path: np.frombuffer(values, dtype=np.float64) for path, values in columns.items()})
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def column(self, path):
+        return self.columns[path]
+
+    def _ratio(self, numerator, denominator):
+        out = np.full(numerator.shape, np.nan)
+        np.divide(numerator, denominator, out=out, where=~(np.abs(denominator) < self.MIN_DELTA_T))
+        return np.round(out * 100, 1)
+
+    def supplyEfficiency(self):
+        # samma som FlexitGo._to_efficiency, NaN där frånluft och uteluft är för lika
+        outside = self.columns[FlexitGo.OUTSIDE_AIR_TEMPERATURE_PATH]
+        return self._ratio(self.columns[FlexitGo.SUPPLY_AIR_TEMPERATURE_PATH] - outside,
+                           self.columns[FlexitGo.EXTRACT_AIR_TEMPERATURE_PATH] - outside)
+
+    def extractEfficiency(self):
+        # samma som FlexitGo._from_efficiency
+        extract = self.columns[FlexitGo.EXTRACT_AIR_TEMPERATURE_PATH]
+        return self._ratio(extract - self.columns[FlexitGo.EXHAUST_AIR_TEMPERATURE_PATH],
+                           extract - self.columns[FlexitGo.OUTSIDE_AIR_TEMPERATURE_PATH])
+
+    def rolling(self, values, window):
+        # glidande medel över de senaste window sekunderna, NaN hoppas över
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        sums = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0))))
+        counts = np.concatenate(([0], np.cumsum(valid)))
+        first = np.searchsorted(self.timestamps, self.timestamps - window, side="left")
+        last = np.arange(1, len(values) + 1)
+        count = counts[last] - counts[first]
+        mean = np.full(len(values), np.nan)
+        np.divide(sums[last] - sums[first], count, out=mean, where=count > 0)
+        return {"mean": mean, "count": count}
+
+    def buckets(self, values, size):
+        # min/max/medel/sista per tidsintervall om size sekunder, bara intervall som har värden kommer med
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        timestamps, values = self.timestamps[valid], values[valid]
+        if not len(values):
+            empty = np.empty(0)
+            return {"start": empty, "min": empty, "max": empty, "mean": empty, "last": empty, "count": np.empty(0, dtype=np.int64)}
+
+        bucket = np.floor(timestamps / size).astype(np.int64)
+        starts = np.flatnonzero(np.diff(bucket, prepend=bucket[0] - 1))
+        counts = np.diff(np.append(starts, len(values)))
+        return {"start": bucket[starts] * float(size),
+                "min": np.minimum.reduceat(values, starts),
+                "max": np.maximum.reduceat(values, starts),
+                "mean": np.add.reduceat(values, starts) / counts,
+                "last": values[np.append(starts[1:], len(values)) - 1],
+                "count": counts}
+
+    def degreeHours(self, base=17.0):
+        # uppvärmningsgradtimmar mot base, varje värde gäller fram till nästa så länge uppehållet är kortare än MAX_GAP
+        outside = self.columns[FlexitGo.OUTSIDE_AIR_TEMPERATURE_PATH]
+        if len(outside) < 2:
+            return np.zeros(len(outside))
+        hours = np.diff(self.timestamps) / 3600
+        deficit = np.clip(base - outside[:-1], 0, None)
+        contribution = np.where((hours * 3600 <= self.MAX_GAP) & ~np.isnan(deficit), deficit * hours, 0.0)
+        return np.concatenate(([0.0], np.cumsum(contribution)))
+
+    def filterWearRate(self):
+        # drifttimmar per timme i verkligheten, 1.0 om fläkten alltid går eller om det inte går att skatta
+        operating = self.columns[FlexitGo.FILTER_OPERATING_TIME_PATH]
+        valid = ~np.isnan(operating)
+        if valid.sum() < 2 or np.ptp(self.timestamps[valid]) < 3600:
+            return 1.0
+        slope = np.polyfit(self.timestamps[valid] / 3600, operating[valid], 1)[0]
+        return float(slope) if slope > 0 else 1.0
+
+    def filterExchange(self, rate=None):
+        # beräknad tidpunkt (epoch) för filterbyte per rad, utifrån kvarvarande timmar och uppmätt slitagetakt
+        rate = self.filterWearRate() if rate is None else rate
+        remaining = self.columns[FlexitGo.FILTER_TIME_FOR_EXCHANGE_PATH] - self.columns[FlexitGo.FILTER_OPERATING_TIME_PATH]
+        return self.timestamps + remaining * 3600 / rate
+
+    def filterExchangeDate(self):
+        projected = self.filterExchange()
+        valid = projected[~np.isnan(projected)]
+        if not len(valid):
+            return None
+        return datetime.fromtimestamp(valid[-1], self.TZ).strftime("%Y-%m-%d")
+
+    def summary(self, base=17.0):
+        supply, extract = self.supplyEfficiency(), self.extractEfficiency()
+        degreeHours = self.degreeHours(base)
+        return {"rows": len(self),
+                "verkningsgrad_tilluft": float(np.nanmean(supply)) if np.any(~np.isnan(supply)) else None,
+                "verkningsgrad_frånluft": float(np.nanmean(extract)) if np.any(~np.isnan(extract)) else None,
+                "degree_hours": float(degreeHours[-1]) if len(degreeHours) else 0.0,
+                "filter_time_for_exchange": self.filterExchangeDate()}
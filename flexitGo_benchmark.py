@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import asyncio
+import itertools
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import ujson
+
+from API import flexitGo_API
+from API.flexitGo_API_async import FlexitGo
+from API.flexitGo_fakeserver import FakeClimatix
+
+OPERATIONS = ["getSensors", "getDevice", "setSensor", "setPresetMode"]
+
+
+def _serve(queue, serverParams):
+    async def main():
+        server = FakeClimatix(**serverParams)
+        queue.put(await server.start())
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def startServer(**serverParams):
+    # servern körs i en egen process så att CPU-tiden per anrop bara gäller klienten
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(queue, serverParams), daemon=True)
+    process.start()
+    return process, queue.get(timeout=30)
+
+
+def summarize(client, op, latencies, errors, wall, cpu):
+    calls = len(latencies)
+    if calls > 1:
+        q = statistics.quantiles(latencies, n=100)
+        p50, p95, p99 = q[49], q[94], q[98]
+    else:
+        p50 = p95 = p99 = latencies[0] if latencies else 0.0
+
+    return {"client": client,
+            "op": op,
+            "calls": calls,
+            "errors": errors,
+            "throughput": calls / wall if wall else 0.0,
+            "p50": p50 * 1000,
+            "p95": p95 * 1000,
+            "p99": p99 * 1000,
+            "cpu": cpu / calls * 1000 if calls else 0.0}
+
+
+async def benchAsync(baseUrl, calls, concurrency, cached, workdir):
+    fg = await FlexitGo.create("bench", "bench",
+                               BASE_URL=baseUrl,
+                               RETRY_DELAY=0.05,
+                               tokenFileName=os.path.join(workdir, "tokenfile.txt"),
+                               lastSessionFileName=os.path.join(workdir, "lastsessionfile.txt"))
+    modes = itertools.cycle(["HIGH", "HOME"])
+
+    async def _call(op):
+        if op == "getSensors":
+            if not cached:
+                fg.invalidate()
+            return await fg.getSensors()
+        if op == "getDevice":
+            if not cached:
+                fg.invalidate()
+            return await fg.getDevice()
+        if op == "setSensor":
+            return await fg.setSensor(FlexitGo.HOME_AIR_TEMPERATURE_PATH, 20)
+        if op == "setPresetMode":
+            return await fg.setPresetMode(next(modes))
+
+    results = []
+    for op in OPERATIONS:
+        latencies = []
+        errors = 0
+        remaining = iter(range(calls))
+
+        async def _worker():
+            nonlocal errors
+            for _ in remaining:
+                started = time.perf_counter()
+                out = await _call(op)
+                latencies.append(time.perf_counter() - started)
+                # setPresetMode ger None när läget redan är satt, det räknas inte som fel
+                if out is False or out == {}:
+                    errors += 1
+
+        wallStart, cpuStart = time.perf_counter(), time.process_time()
+        await asyncio.gather(*[_worker() for _ in range(concurrency)])
+        results.append(summarize("async", op, latencies, errors, time.perf_counter() - wallStart, time.process_time() - cpuStart))
+
+    await fg.apiHandler.closeSession()
+    return results
+
+
+def benchSync(baseUrl, calls):
+    fg = flexitGo_API.FlexitGo(apiUrl=baseUrl)
+    fg.login("bench", "bench")
+    modes = itertools.cycle(["HIGH", "HOME"])
+
+    def _call(op):
+        if op == "getSensors":
+            return fg.getSensors()
+        if op == "getDevice":
+            return fg.getDevice()
+        if op == "setSensor":
+            return fg.setSensor(fg.HOME_AIR_TEMPERATURE_PATH, 20)
+        if op == "setPresetMode":
+            return fg.setPresetMode(next(modes))
+
+    results = []
+    for op in OPERATIONS:
+        latencies = []
+        errors = 0
+        wallStart, cpuStart = time.perf_counter(), time.process_time()
+        for _ in range(calls):
+            started = time.perf_counter()
+            out = _call(op)
+            latencies.append(time.perf_counter() - started)
+            if out is False or out == {}:
+                errors += 1
+        results.append(summarize("sync", op, latencies, errors, time.perf_counter() - wallStart, time.process_time() - cpuStart))
+
+    return results
+
+
+STARTUP_SNIPPET = """
+import asyncio, json, os, sys, time
+t0 = time.perf_counter()
+from API.flexitGo_API_async import FlexitGo
+t1 = time.perf_counter()
+
+async def main():
+    fg = await FlexitGo.create("bench", "bench", lazy=sys.argv[2] == "lazy", BASE_URL=sys.argv[1], RETRY_DELAY=0.05,
+                               tokenFileName=os.path.join(sys.argv[3], "tokenfile.txt"),
+                               lastSessionFileName=os.path.join(sys.argv[3], "lastsessionfile.txt"))
+    t2 = time.perf_counter()
+    await fg.getSensors()
+    t3 = time.perf_counter()
+    await fg.apiHandler.closeSession()
+    return t2, t3
+
+t2, t3 = asyncio.run(main())
+print(json.dumps({"import": t1 - t0, "create": t2 - t1, "first": t3 - t2, "total": t3 - t0}))
+"""
+
+
+def benchStartup(baseUrl, runs):
+    # varje körning i en ny process, utan tokenfil, så att både import och login räknas som kallstart
+    lines = [f"{'mode':<7}{'import ms':>11}{'create ms':>11}{'first ms':>11}{'total ms':>11}"]
+    for mode in ("eager", "lazy"):
+        samples = []
+        for _ in range(runs):
+            with tempfile.TemporaryDirectory() as workdir:
+                out = subprocess.run([sys.executable, "-c", STARTUP_SNIPPET, baseUrl, mode, workdir], capture_output=True, text=True, check=True)
+                samples.append(ujson.loads(out.stdout.strip().splitlines()[-1]))
+        median = {key: statistics.median(sample[key] for sample in samples) * 1000 for key in samples[0]}
+        lines.append(f"{mode:<7}{median['import']:>11.1f}{median['create']:>11.1f}{median['first']:>11.1f}{median['total']:>11.1f}")
+    return "\n".join(lines)
+
+
+def report(results):
+    lines = [f"{'client':<7}{'op':<15}{'calls':>7}{'errors':>8}{'calls/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'cpu ms/call':>13}"]
+    for r in results:
+        lines.append(f"{r['client']:<7}{r['op']:<15}{r['calls']:>7}{r['errors']:>8}{r['throughput']:>10.1f}{r['p50']:>10.2f}{r['p95']:>10.2f}{r['p99']:>10.2f}{r['cpu']:>13.3f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FlexitGo clients against a local fake Climatix API")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--plants", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.005)
+    parser.add_argument("--error401", type=float, default=0.0)
+    parser.add_argument("--error429", type=float, default=0.0)
+    parser.add_argument("--error5xx", type=float, default=0.0)
+    parser.add_argument("--cached", action="store_true", help="let the async client serve reads from its TTL cache")
+    parser.add_argument("--clients", default="async,sync")
+    parser.add_argument("--startup", type=int, default=0, metavar="RUNS", help="measure cold start (import, create, first getSensors) over RUNS fresh processes instead")
+    args = parser.parse_args()
+
+    process, baseUrl = startServer(plants=args.plants, latency=args.latency, jitter=args.jitter,
+                                   error401=args.error401, error429=args.error429, error5xx=args.error5xx)
+    results = []
+    try:
+        if args.startup:
+            print(benchStartup(baseUrl, args.startup))
+            return
+
+        clients = args.clients.split(",")
+        if "async" in clients:
+            with tempfile.TemporaryDirectory() as workdir:
+                results += asyncio.run(benchAsync(baseUrl, args.calls, args.concurrency, args.cached, workdir))
+        if "sync" in clients:
+            results += benchSync(baseUrl, args.calls)
+
+    finally:
+        process.terminate()
+
+    print(report(results))
+
+
+if __name__ == "__main__":
+    main()
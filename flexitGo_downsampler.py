@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+from array import array
+
+import structlog
+
+from API.flexitGo_API_async import SensorSnapshot
+
+
+class SensorDownsampler:
+    log = structlog.get_logger(__name__)
+
+    FIELDS = ("room_temperature", "Tilluft", "Frånluft", "Avluft", "Uteluft", "supply_fan_speed", "extract_fan_speed")
+    # upplösning i sekunder, alla håller HORIZON sekunder bakåt
+    RESOLUTIONS = (60, 10*60, 60*60)
+    HORIZON = 24*60*60
+
+    def __init__(self, fields=None, resolutions=None, horizon=None):
+        self.fields = tuple(fields or self.FIELDS)
+        self.sources = tuple(SensorSnapshot.INDEX[name] for name in self.fields)
+        self.fieldIndex = {name: index for index, name in enumerate(self.fields)}
+        self.resolutions = tuple(resolutions or self.RESOLUTIONS)
+        self.horizon = horizon or self.HORIZON
+
+        # en ring per upplösning, allt allokeras här och skrivs sedan över på plats
+        self.rings = {}
+        for resolution in self.resolutions:
+            slots = -(-self.horizon // resolution)
+            size = slots * len(self.fields)
+            self.rings[resolution] = {"slots": slots,
+                                      "bucket": array("q", [-1]) * slots,
+                                      "min": array("d", [math.inf]) * size,
+                                      "max": array("d", [-math.inf]) * size,
+                                      "sum": array("d", [0.0]) * size,
+                                      "count": array("l", [0]) * size,
+                                      "last": array("d", [math.nan]) * size}
+
+    def add(self, snapshot):
+        self.addValues(snapshot.timestamp, snapshot.values)
+
+    def addValues(self, timestamp, values):
+        # values är SensorSnapshot.values, eller något annat som indexeras likadant
+        width = len(self.fields)
+        for resolution, ring in self.rings.items():
+            bucket = int(timestamp // resolution)
+            slot = bucket % ring["slots"]
+            base = slot * width
+            mins, maxs, sums, counts, lasts = ring["min"], ring["max"], ring["sum"], ring["count"], ring["last"]
+
+            if ring["bucket"][slot] != bucket:
+                if ring["bucket"][slot] > bucket:
+                    # äldre än det som redan ligger i platsen, har redan roterat ut
+                    continue
+                ring["bucket"][slot] = bucket
+                for offset in range(base, base + width):
+                    mins[offset] = math.inf
+                    maxs[offset] = -math.inf
+                    sums[offset] = 0.0
+                    counts[offset] = 0
+                    lasts[offset] = math.nan
+
+            for offset, source in enumerate(self.sources, base):
+                value = values[source]
+                if value != value:  # NaN
+                    continue
+                if value < mins[offset]:
+                    mins[offset] = value
+                if value > maxs[offset]:
+                    maxs[offset] = value
+                sums[offset] += value
+                counts[offset] += 1
+                lasts[offset] = value
+
+    def series(self, field, resolution, now=None):
+        # [(start, min, max, mean, last)] i tidsordning för hinkar inom horisonten, utan tomma hinkar
+        ring = self.rings[resolution]
+        index = self.fieldIndex[field]
+        width = len(self.fields)
+        buckets = ring["bucket"]
+        newest = max(buckets) if now is None else int(now // resolution)
+        oldest = newest - ring["slots"] + 1
+
+        out = []
+        for bucket in range(oldest, newest + 1):
+            slot = bucket % ring["slots"]
+            if buckets[slot] != bucket:
+                continue
+            offset = slot * width + index
+            count = ring["count"][offset]
+            if count:
+                out.append((bucket * resolution, ring["min"][offset], ring["max"][offset], ring["sum"][offset] / count, ring["last"][offset]))
+        return out
+
+    def latest(self, field, resolution):
+        out = self.series(field, resolution)
+        return out[-1] if out else None
+
+    def clear(self):
+        for ring in self.rings.values():
+            for slot in range(ring["slots"]):
+                ring["bucket"][slot] = -1
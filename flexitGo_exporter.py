@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import math
+import time
+
+import structlog
+from aiohttp import web
+
+from API.flexitGo_API_async import FlexitGo, SensorSnapshot
+
+
+class FlexitGoExporter:
+    log = structlog.get_logger(__name__)
+
+    POLL_INTERVAL = 60
+    DEVICE_INTERVAL = 60*60
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    # (metric, typ, hjälptext, nyckel i APISessionHandler.counters)
+    COUNTERS = (("apihandler_retries_total", "counter", "Retried request attempts", "retries"),
+                ("apihandler_throttle_waits_total", "counter", "Times a request waited for the rate limiter", "throttleWaits"),
+                ("apihandler_throttle_wait_seconds_total", "counter", "Seconds spent waiting for the rate limiter", "throttleSeconds"),
+                ("apihandler_logins_total", "counter", "Successful logins", "logins"),
+                ("apihandler_token_refreshes_total", "counter", "Successful token refreshes", "tokenRefreshes"),
+                ("apihandler_fail_fast_total", "counter", "Requests rejected while the circuit was open", "failFast"))
+
+    def __init__(self, flexitGo, plantIds=None, pollInterval=None, deviceInterval=None):
+        self.flexitGo = flexitGo
+        self.plants = [flexitGo.forPlant(plantId) for plantId in plantIds] if plantIds else [flexitGo]
+        self.pollInterval = pollInterval or self.POLL_INTERVAL
+        self.deviceInterval = deviceInterval or self.DEVICE_INTERVAL
+        self.snapshots = {}
+        self.devices = {}
+        self.task = None
+        self.runner = None
+        self.baseUrl = None
+        self.prefixes = {}
+        self.statusPrefixes = {}
+        self._buildStatic()
+
+    def _buildStatic(self):
+        # allt som inte beror på värdena byggs en gång, en scrape fyller bara i siffrorna
+        handler = self.flexitGo.apiHandler.name
+        self.handlerLabel = f'handler="{handler}"'
+        self.counterLines = tuple((f"# HELP {metric} {text}\n# TYPE {metric} {kind}\n", f"{metric}{{{self.handlerLabel}}} ", key) for metric, kind, text, key in self.COUNTERS)
+        self.circuitLines = (f"# HELP apihandler_circuit_open 1 while the circuit breaker is open or half-open\n# TYPE apihandler_circuit_open gauge\napihandler_circuit_open{{{self.handlerLabel}}} ",
+                             f"# HELP apihandler_circuit_opens_total Times the circuit breaker opened\n# TYPE apihandler_circuit_opens_total counter\napihandler_circuit_opens_total{{{self.handlerLabel}}} ")
+
+    def _plantPrefixes(self, plantId):
+        prefixes = self.prefixes.get(plantId)
+        if prefixes is None:
+            prefixes = self.prefixes[plantId] = {"sensors": [f'flexitgo_sensor{{plant="{plantId}",group="{group}",name="{name}"}} ' for group, name, path in SensorSnapshot.FIELDS],
+                                                 "updated": f'flexitgo_last_update_timestamp_seconds{{plant="{plantId}"}} '}
+        return prefixes
+
+    def _statusPrefix(self, status):
+        prefix = self.statusPrefixes.get(status)
+        if prefix is None:
+            prefix = self.statusPrefixes[status] = f'apihandler_requests_total{{{self.handlerLabel},status="{status}"}} '
+        return prefix
+
+    @staticmethod
+    def _escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    def _deviceLine(self, plantId, device):
+        labels = ",".join(f'{key}="{self._escape(value)}"' for key, value in sorted(device.items()))
+        return f'flexitgo_device_info{{plant="{plantId}",{labels}}} 1'
+
+    async def _poll(self, plant, device):
+        snapshot = await plant.getSensors(snapshot=True)
+        if snapshot is not None:
+            self.snapshots[plant.plantId] = snapshot
+        if device:
+            info = await plant.getDevice()
+            if info:
+                self.devices[plant.plantId] = self._deviceLine(plant.plantId, info)
+
+    async def refresh(self, device=False):
+        try:
+            if self.flexitGo.plantId is None:
+                await self.flexitGo.getPlant()
+            await asyncio.gather(*[self._poll(plant, device or plant.plantId not in self.devices) for plant in self.plants])
+
+        except Exception as e:
+            self.log.error("Exception in refresh", error=e)
+
+    async def _pollLoop(self):
+        # polltakten styrs här, inte av hur ofta Prometheus skrapar
+        lastDevice = 0
+        while True:
+            try:
+                now = time.monotonic()
+                device = now - lastDevice >= self.deviceInterval
+                await self.refresh(device=device)
+                if device:
+                    lastDevice = now
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception as e:
+                self.log.error("Exception in _pollLoop", error=e)
+
+            await asyncio.sleep(self.pollInterval)
+
+    def render(self):
+        lines = ["# HELP flexitgo_sensor Latest decoded FlexitGo datapoint\n# TYPE flexitgo_sensor gauge"]
+        updated = ["# HELP flexitgo_last_update_timestamp_seconds When the datapoints were read\n# TYPE flexitgo_last_update_timestamp_seconds gauge"]
+        for plantId, snapshot in self.snapshots.items():
+            prefixes = self._plantPrefixes(plantId)
+            for prefix, value in zip(prefixes["sensors"], snapshot.values):
+                if not math.isnan(value):
+                    lines.append(f"{prefix}{value}")
+            updated.append(f"{prefixes['updated']}{snapshot.timestamp}")
+        lines += updated
+
+        if self.devices:
+            lines.append("# HELP flexitgo_device_info Device information\n# TYPE flexitgo_device_info gauge")
+            lines += self.devices.values()
+
+        handler = self.flexitGo.apiHandler
+        lines.append("# HELP apihandler_requests_total Responses by HTTP status, 500 for connection errors and 999 for other exceptions\n# TYPE apihandler_requests_total counter")
+        for status, count in handler.statusCounts.items():
+            lines.append(f"{self._statusPrefix(status)}{count}")
+        for header, prefix, key in self.counterLines:
+            lines.append(f"{header}{prefix}{handler.counters[key]}")
+        lines.append(f"{self.circuitLines[0]}{int(handler.breaker.state != handler.breaker.CLOSED)}")
+        lines.append(f"{self.circuitLines[1]}{handler.breaker.opens}")
+
+        if handler.latency is not None and handler.latency.histograms:
+            lines.append(f"# HELP {handler.latency.METRIC} Request latency per phase\n" + handler.latency.render())
+        return "\n".join(lines) + "\n"
+
+    async def _metrics(self, request):
+        return web.Response(body=self.render().encode(), headers={"Content-Type": self.CONTENT_TYPE})
+
+    async def start(self, host="127.0.0.1", port=9610):
+        self.task = asyncio.get_running_loop().create_task(self._pollLoop())
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.baseUrl = f"http://{host}:{port}"
+        self.log.info(f"FlexitGo exporter listening on {self.baseUrl}/metrics")
+        return self.baseUrl
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description="Prometheus exporter for FlexitGo datapoints and API client metrics")
+    parser.add_argument("--username", default=os.environ.get("FLEXITGO_USERNAME"))
+    parser.add_argument("--password", default=os.environ.get("FLEXITGO_PASSWORD"))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9610)
+    parser.add_argument("--interval", type=float, default=FlexitGoExporter.POLL_INTERVAL)
+    parser.add_argument("--all-plants", action="store_true", help="export every plant on the account, not only the last one")
+    args = parser.parse_args()
+
+    async def main():
+        flexitGo = await FlexitGo.create(args.username, args.password)
+        exporter = FlexitGoExporter(flexitGo, plantIds=FlexitGo.plantIds if args.all_plants else None, pollInterval=args.interval)
+        await exporter.start(args.host, args.port)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await exporter.stop()
+            await flexitGo.apiHandler.closeSession()
+
+    asyncio.run(main())
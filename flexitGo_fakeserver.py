@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import itertools
+import random
+import time
+from email.utils import formatdate
+
+import structlog
+import ujson
+from aiohttp import web
+
+from API.flexitGo_API_async import FlexitGo
+
+
+class FakeClimatix:
+    log = structlog.get_logger(__name__)
+
+    # startvärden för sensorer, allt annat blir 0
+    SENSOR_VALUES = {FlexitGo.MODE_PATH: 3,
+                     FlexitGo.MODE_HOME_HIGH_CAL_PUT_PATH: 3,
+                     FlexitGo.OUTSIDE_AIR_TEMPERATURE_PATH: 4.2,
+                     FlexitGo.SUPPLY_AIR_TEMPERATURE_PATH: 18.6,
+                     FlexitGo.EXTRACT_AIR_TEMPERATURE_PATH: 21.4,
+                     FlexitGo.EXHAUST_AIR_TEMPERATURE_PATH: 7.1,
+                     FlexitGo.HOME_AIR_TEMPERATURE_PATH: 20.0,
+                     FlexitGo.AWAY_AIR_TEMPERATURE_PATH: 16.0,
+                     FlexitGo.ROOM_TEMPERATURE_PATH: 21.2,
+                     FlexitGo.FILTER_OPERATING_TIME_PATH: 1200,
+                     FlexitGo.FILTER_TIME_FOR_EXCHANGE_PATH: 4380,
+                     FlexitGo.HEAT_EXCHANGER_SPEED_PATH: 100,
+                     FlexitGo.SUPPLY_FAN_SPEED_PATH: 1850,
+                     FlexitGo.SUPPLY_FAN_CONTROL_SIGNAL_PATH: 45.0,
+                     FlexitGo.EXTRACT_FAN_SPEED_PATH: 1900,
+                     FlexitGo.EXTRACT_FAN_CONTROL_SIGNAL_PATH: 47.0,
+                     FlexitGo.BOOST_DURATION_PATH: 30,
+                     FlexitGo.FIREPLACE_DURATION_PATH: 10,
+                     FlexitGo.AWAY_DELAY_PATH: 5}
+
+    DEVICE_VALUES = {FlexitGo.APPLICATION_SOFTWARE_VERSION_PATH: "1.11.0",
+                     FlexitGo.DEVICE_DESCRIPTION_PATH: "Nordic S3",
+                     FlexitGo.MODEL_NAME_PATH: "POU.0011R",
+                     FlexitGo.MODEL_INFORMATION_PATH: "S3 R",
+                     FlexitGo.SERIAL_NUMBER_PATH: "800131-000000",
+                     FlexitGo.FIRMWARE_REVISION_PATH: "FW-1.11",
+                     FlexitGo.OFFLINE_ONLINE_PATH: "Online",
+                     FlexitGo.SYSTEM_STATUS_PATH: "Operational",
+                     FlexitGo.LAST_RESTART_REASON_PATH: 1}
+
+    def __init__(self, plants=1, latency=0.0, jitter=0.0, error401=0.0, error429=0.0, error5xx=0.0, tokenLifetime=24*60*60, seed=None):
+        self.plantIds = [f"P{i:06d}" for i in range(plants)]
+        self.latency = latency
+        self.jitter = jitter
+        self.error401 = error401
+        self.error429 = error429
+        self.error5xx = error5xx
+        self.tokenLifetime = tokenLifetime
+        self.random = random.Random(seed)
+        self.tokens = {}
+        self.tokenCounter = itertools.count(1)
+        self.values = {}
+        self.counts = {}
+        self.runner = None
+        self.baseUrl = None
+
+        for plantId in self.plantIds:
+            for path in FlexitGo.SENSOR_DATA_PATH_LIST:
+                self.values[f"{plantId}{path}"] = {"value": {"value": self.SENSOR_VALUES.get(path, 0), "presentPriority": 16}}
+            for path in FlexitGo.DEVICE_INFO_PATH_LIST:
+                self.values[f"{plantId}{path}"] = {"value": self.DEVICE_VALUES.get(path, "")}
+
+    def _app(self):
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_post(FlexitGo.TOKEN_PATH, self._token)
+        app.router.add_get(FlexitGo.PLANTS_PATH, self._plants)
+        app.router.add_get(FlexitGo.VALUES_PATH, self._getValues)
+        app.router.add_put(f"{FlexitGo.DATAPOINTS_PATH}/{{path}}", self._putValue)
+        return app
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        self.counts[request.method] = self.counts.get(request.method, 0) + 1
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+
+        if request.path != FlexitGo.TOKEN_PATH:
+            roll = self.random.random()
+            if roll < self.error429:
+                return web.Response(status=429, text="Rate limit is exceeded")
+            if roll < self.error429 + self.error5xx:
+                return web.Response(status=self.random.choice([500, 502, 503]), text="Internal server error")
+            if roll < self.error429 + self.error5xx + self.error401 or not self._authorized(request):
+                return web.Response(status=401, text="Authorization has been denied for this request.")
+
+        return await handler(request)
+
+    def _authorized(self, request):
+        token = request.headers.get("Authorization", "").replace("Bearer ", "", 1)
+        return self.tokens.get(token, 0) > time.time()
+
+    async def _token(self, request):
+        await request.read()
+        token = f"fake-{next(self.tokenCounter)}"
+        expires = time.time() + self.tokenLifetime
+        self.tokens[token] = expires
+        return web.json_response({"access_token": token,
+                                  "token_type": "bearer",
+                                  "expires_in": self.tokenLifetime,
+                                  ".expires": formatdate(expires, usegmt=True)}, dumps=ujson.dumps)
+
+    async def _plants(self, request):
+        return web.json_response({"items": [{"id": plantId} for plantId in self.plantIds]}, dumps=ujson.dumps)
+
+    async def _getValues(self, request):
+        try:
+            keys = [d["DataPoints"] for d in ujson.loads(request.query["filterId"])]
+        except (KeyError, ValueError, TypeError):
+            return web.Response(status=400, text="Bad filterId")
+
+        return web.json_response({"values": {key: self.values[key] for key in keys if key in self.values}}, dumps=ujson.dumps)
+
+    async def _putValue(self, request):
+        key = request.match_info["path"]
+        body = ujson.loads(await request.text())
+        entry = self.values.get(key)
+        if entry is None:
+            return web.Response(status=404, text="Not found")
+
+        value = body.get("Value")
+        if isinstance(entry["value"], dict):
+            entry["value"]["value"] = float(value) if value is not None and "." in value else int(value) if value is not None else None
+        else:
+            entry["value"] = value
+
+        # HOME/HIGH skrivs på kalenderpunkten men syns på MODE_PATH
+        if key.endswith(FlexitGo.MODE_HOME_HIGH_CAL_PUT_PATH) and value is not None:
+            modeKey = f"{key[:-len(FlexitGo.MODE_HOME_HIGH_CAL_PUT_PATH)]}{FlexitGo.MODE_PATH}"
+            self.values[modeKey]["value"]["value"] = int(value)
+
+        return web.json_response({"stateTexts": {key: "Success"}}, dumps=ujson.dumps)
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.runner = web.AppRunner(self._app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.baseUrl = f"http://{host}:{port}"
+        self.log.info(f"Fake Climatix listening on {self.baseUrl}", plants=len(self.plantIds))
+        return self.baseUrl
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local stand-in for the Climatix API used by FlexitGo")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--plants", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error401", type=float, default=0.0)
+    parser.add_argument("--error429", type=float, default=0.0)
+    parser.add_argument("--error5xx", type=float, default=0.0)
+    args = parser.parse_args()
+
+    async def main():
+        server = FakeClimatix(plants=args.plants, latency=args.latency, jitter=args.jitter,
+                              error401=args.error401, error429=args.error429, error5xx=args.error5xx)
+        await server.start(args.host, args.port)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.stop()
+
+    asyncio.run(main())
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+import mmap
+import os
+import struct
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+import structlog
+import ujson
+
+from API.flexitGo_API_async import FlexitGo, SensorSnapshot
+
+
+class SensorRecorder:
+    log = structlog.get_logger(__name__)
+
+    VERSION = 1
+    SCHEMA_FILE = "schema.json"
+    TIME_FILE = "ts.i"
+    BLOCK_FILE = "blocks.q"
+
+    # fast bredd per typ, flyttal sparas som int16 i tiondelar eftersom registret ändå avrundar till en decimal
+    KINDS = {"float": ("h", 10), "int": ("h", 1), "bool": ("B", 1)}
+    # filtertiderna är timmar och växer förbi int16
+    WIDE = {FlexitGo.FILTER_OPERATING_TIME_PATH: ("i", 1),
+            FlexitGo.FILTER_TIME_FOR_EXCHANGE_PATH: ("i", 1)}
+    MISSING = {"h": -2**15, "i": -2**31, "B": 255}
+    LIMITS = {"h": (-2**15 + 1, 2**15 - 1), "i": (-2**31 + 1, 2**31 - 1), "B": (0, 254)}
+
+    # tidsstämplar är ms från blockets bas i int32, nytt block när avståndet inte längre ryms
+    MAX_DELTA = 2**31 - 1
+
+    def __init__(self, directory, paths=None):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        schemaFile = os.path.join(directory, self.SCHEMA_FILE)
+        if os.path.exists(schemaFile):
+            with open(schemaFile) as f:
+                schema = ujson.load(f)
+            if paths is not None and list(paths) != [column["path"] for column in schema["columns"]]:
+                raise ValueError(f"{directory} was recorded with other datapoints")
+        else:
+            schema = {"version": self.VERSION, "columns": [self._column(index, path) for index, path in enumerate(paths or FlexitGo.SENSOR_DATA_PATH_LIST)]}
+            with open(schemaFile, "w") as f:
+                ujson.dump(schema, f, indent=2)
+
+        self.columns = schema["columns"]
+        self.paths = [column["path"] for column in self.columns]
+        self.index = {path: index for index, path in enumerate(self.paths)}
+
+        # var i SensorSnapshot.values varje kolumn finns, så att en snapshot kan sparas utan att avkodas igen
+        snapshotIndex = {}
+        for index, (group, name, path) in enumerate(SensorSnapshot.FIELDS):
+            snapshotIndex.setdefault(path, index)
+        self.snapshotIndex = [snapshotIndex.get(path) for path in self.paths]
+
+        self.blocks = array("q")
+        blockFile = os.path.join(directory, self.BLOCK_FILE)
+        if os.path.exists(blockFile):
+            with open(blockFile, "rb") as f:
+                self.blocks.frombytes(f.read())
+
+        self.rows = self._repair()
+        self.lastMs = self._timeMs(self.rows - 1) if self.rows else None
+
+        self.files = {name: open(os.path.join(directory, name), "ab") for name in self._fileNames()}
+
+    def _column(self, index, path):
+        kind = FlexitGo.DATAPOINTS.get(path, ("other", "float"))[1]
+        code, scale = self.WIDE.get(path) or self.KINDS[kind]
+        return {"path": path, "kind": kind, "file": f"c{index:02d}.{code}", "code": code, "scale": scale}
+
+    def _fileNames(self):
+        return [self.TIME_FILE, self.BLOCK_FILE] + [column["file"] for column in self.columns]
+
+    def _repair(self):
+        # efter ett avbrott mitt i en rad kan kolumnerna ha olika längd, kapa allt till den kortaste
+        widths = [(self.TIME_FILE, 4)] + [(column["file"], struct.calcsize(column["code"])) for column in self.columns]
+        sizes = {name: os.path.getsize(os.path.join(self.directory, name)) if os.path.exists(os.path.join(self.directory, name)) else 0 for name, width in widths}
+        rows = min(sizes[name] // width for name, width in widths)
+
+        while self.blocks and self.blocks[-1] >= rows:
+            del self.blocks[-2:]
+        widths.append((self.BLOCK_FILE, 0))
+        sizes[self.BLOCK_FILE] = os.path.getsize(os.path.join(self.directory, self.BLOCK_FILE)) if os.path.exists(os.path.join(self.directory, self.BLOCK_FILE)) else 0
+
+        for name, width in widths:
+            size = len(self.blocks) * 8 if name == self.BLOCK_FILE else rows * width
+            if sizes[name] > size:
+                self.log.warning(f"Truncating {name} in {self.directory} to {rows} rows")
+                os.truncate(os.path.join(self.directory, name), size)
+        return rows
+
+    def __len__(self):
+        return self.rows
+
+    def record(self, snapshot):
+        row = [None if index is None else snapshot.values[index] for index in self.snapshotIndex]
+        self._append(snapshot.timestamp, row)
+
+    def append(self, timestamp, values):
+        # values är {path: värde} med samma typer som FlexitGo.registry.decode ger
+        self._append(timestamp, [values.get(path) for path in self.paths])
+
+    def _append(self, timestamp, row):
+        try:
+            ms = int(round(timestamp * 1000))
+            if self.lastMs is not None and ms < self.lastMs:
+                self.log.warning("Skipping sample older than the last recorded one", timestamp=timestamp)
+                return
+
+            if not self.blocks or ms - self.blocks[-2] > self.MAX_DELTA:
+                block = array("q", (ms, self.rows))
+                self.blocks.extend(block)
+                self.files[self.BLOCK_FILE].write(block.tobytes())
+
+            self.files[self.TIME_FILE].write(array("i", (ms - self.blocks[-2],)).tobytes())
+            for column, value in zip(self.columns, row):
+                self.files[column["file"]].write(array(column["code"], (self._encode(column, value),)).tobytes())
+
+            self.rows += 1
+            self.lastMs = ms
+            self.flush()
+
+        except Exception as e:
+            self.log.error("Exception in SensorRecorder append", error=e)
+
+    def _encode(self, column, value):
+        code = column["code"]
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            return self.MISSING[code]
+        value = int(round(float(value) * column["scale"]))
+        low, high = self.LIMITS[code]
+        return value if low <= value <= high else self.MISSING[code]
+
+    def flush(self):
+        for f in self.files.values():
+            f.flush()
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+    def _map(self, name, code):
+        # anropas bara när det finns rader, en tom fil går inte att mappa
+        with open(os.path.join(self.directory, name), "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return mapped, memoryview(mapped).cast(code)
+
+    def _timeMs(self, row):
+        blockIndex = bisect_right(self.blocks[1::2], row) - 1
+        mapped, view = self._map(self.TIME_FILE, "i")
+        try:
+            return self.blocks[blockIndex * 2] + view[row]
+        finally:
+            view.release()
+            mapped.close()
+
+    def _rowRange(self, times, start, end):
+        # blocken hittas på basen, inom blocket är delta sorterade så bisect räcker
+        bases, starts = self.blocks[0::2], self.blocks[1::2]
+
+        def _find(ms, right):
+            blockIndex = max(0, bisect_right(bases, ms) - 1)
+            first = starts[blockIndex]
+            last = starts[blockIndex + 1] if blockIndex + 1 < len(starts) else self.rows
+            delta = ms - bases[blockIndex]
+            if delta < 0:
+                return first
+            search = bisect_right if right else bisect_left
+            return search(times, min(delta, self.MAX_DELTA), first, last)
+
+        first = 0 if start is None else _find(int(math.ceil(start * 1000)), False)
+        last = self.rows if end is None else _find(int(math.floor(end * 1000)), True)
+        return first, max(first, last)
+
+    def range(self, start=None, end=None, paths=None):
+        # strömmar (timestamp, {path: värde}) för start <= timestamp <= end, bara de kolumner som efterfrågas mappas
+        if not self.rows:
+            return
+        self.flush()
+        columns = [self.columns[self.index[path]] for path in (paths or self.paths)]
+        maps = [self._map(self.TIME_FILE, "i")] + [self._map(column["file"], column["code"]) for column in columns]
+        try:
+            times = maps[0][1]
+            first, last = self._rowRange(times, start, end)
+            starts = self.blocks[1::2]
+            blockIndex = max(0, bisect_right(starts, first) - 1)
+            for row in range(first, last):
+                while blockIndex + 1 < len(starts) and starts[blockIndex + 1] <= row:
+                    blockIndex += 1
+                values = {}
+                for column, (mapped, view) in zip(columns, maps[1:]):
+                    raw = view[row]
+                    values[column["path"]] = None if raw == self.MISSING[column["code"]] else self._decode(column, raw)
+                yield (self.blocks[blockIndex * 2] + times[row]) / 1000, values
+
+        finally:
+            for mapped, view in maps:
+                view.release()
+                mapped.close()
+
+    def _decode(self, column, raw):
+        if column["kind"] == "float":
+            return raw / column["scale"]
+        if column["kind"] == "bool":
+            return bool(raw)
+        return raw
+
+    def columnsBetween(self, start=None, end=None, paths=None):
+        # kolumnvis som array("d") med NaN för saknade värden, för analys över långa intervall
+        paths = list(paths or self.paths)
+        timestamps = array("d")
+        out = {path: array("d") for path in paths}
+        if not self.rows:
+            return timestamps, out
+        self.flush()
+
+        maps = [self._map(self.TIME_FILE, "i")] + [self._map(self.columns[self.index[path]]["file"], self.columns[self.index[path]]["code"]) for path in paths]
+        try:
+            times = maps[0][1]
+            first, last = self._rowRange(times, start, end)
+            bases, starts = self.blocks[0::2], self.blocks[1::2]
+            for blockIndex, blockStart in enumerate(starts):
+                blockEnd = starts[blockIndex + 1] if blockIndex + 1 < len(starts) else self.rows
+                low, high = max(first, blockStart), min(last, blockEnd)
+                if low < high:
+                    base = bases[blockIndex]
+                    timestamps.extend((base + delta) / 1000 for delta in times[low:high])
+
+            for path, (mapped, view) in zip(paths, maps[1:]):
+                column = self.columns[self.index[path]]
+                missing, scale = self.MISSING[column["code"]], column["scale"]
+                out[path].extend(math.nan if raw == missing else raw / scale for raw in view[first:last])
+
+        finally:
+            for mapped, view in maps:
+                view.release()
+                mapped.close()
+
+        return timestamps, out
+
+    def last(self):
+        for row in self.range(self.lastMs / 1000 if self.lastMs is not None else None):
+            return row
+
+    def sizeOnDisk(self):
+        return sum(os.path.getsize(os.path.join(self.directory, name)) for name in self._fileNames() + [self.SCHEMA_FILE])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Print recorded FlexitGo sensor rows as JSON lines")
+    parser.add_argument("directory")
+    parser.add_argument("--start", type=float, default=None, help="epoch seconds")
+    parser.add_argument("--end", type=float, default=None, help="epoch seconds")
+    args = parser.parse_args()
+
+    recorder = SensorRecorder(args.directory)
+    for timestamp, values in recorder.range(args.start, args.end):
+        print(ujson.dumps({"timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)), "values": values}))
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import hashlib
+import time
+
+import structlog
+import ujson
+from aiohttp import web
+
+from API.flexitGo_API_async import FlexitGo
+
+
+class FlexitGoServer:
+    log = structlog.get_logger(__name__)
+
+    POLL_INTERVAL = 30
+    DEVICE_INTERVAL = 60*60
+
+    # metoder som får anropas via POST /set/{name}, värdet skickas som {"value": ...}
+    SETTERS = {"setHomeTemp": True,
+               "setAwayTemp": True,
+               "setPresetMode": True,
+               "setFireplaceDuration": True,
+               "setBoostDuration": True,
+               "setAwayDelay": True,
+               "setHeaterState": True,
+               "setCalendarTemporaryOverride": True,
+               "setCalendarActive": False}
+
+    def __init__(self, flexitGo, pollInterval=None, deviceInterval=None):
+        self.flexitGo = flexitGo
+        self.pollInterval = pollInterval or self.POLL_INTERVAL
+        self.deviceInterval = deviceInterval or self.DEVICE_INTERVAL
+        self.cache = {}  # namn: (body, etag, updated)
+        self.ready = {"sensors": asyncio.Event(), "device": asyncio.Event()}
+        self.wake = asyncio.Event()
+        self.writes = asyncio.Queue()
+        self.tasks = []
+        self.runner = None
+        self.baseUrl = None
+
+    def _app(self):
+        app = web.Application()
+        app.router.add_get("/sensors", self._sensors)
+        app.router.add_get("/device", self._device)
+        app.router.add_get("/health", self._health)
+        app.router.add_post("/set/{name}", self._set)
+        return app
+
+    @staticmethod
+    def _etag(data):
+        # svagt ETag utan tidsstämpeln, så att klienter får 304 så länge inget värde ändrats
+        content = {key: value for key, value in data.items() if key != "timestamp"}
+        return f'W/"{hashlib.blake2b(ujson.dumps(content, sort_keys=True).encode(), digest_size=12).hexdigest()}"'
+
+    def _store(self, name, data):
+        if not data:
+            return False
+        etag = self._etag(data)
+        previous = self.cache.get(name)
+        if previous is None or previous[1] != etag:
+            self.cache[name] = (ujson.dumps(data, ensure_ascii=False).encode(), etag, time.time())
+        else:
+            self.cache[name] = (previous[0], etag, time.time())
+        self.ready[name].set()
+        return True
+
+    async def refresh(self, device=False):
+        try:
+            self._store("sensors", await self.flexitGo.getSensors())
+            if device or "device" not in self.cache:
+                self._store("device", await self.flexitGo.getDevice())
+
+        except Exception as e:
+            self.log.error("Exception in refresh", error=e)
+
+    async def _pollLoop(self):
+        # en enda poll mot molnet oavsett hur många lokala klienter som läser
+        lastDevice = 0
+        while True:
+            try:
+                now = time.monotonic()
+                device = now - lastDevice >= self.deviceInterval
+                await self.refresh(device=device)
+                if device and "device" in self.cache:
+                    lastDevice = now
+
+            except asyncio.CancelledError:
+                raise
+
+            except Exception as e:
+                self.log.error("Exception in _pollLoop", error=e)
+
+            try:
+                await asyncio.wait_for(self.wake.wait(), self.pollInterval)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+
+    async def _write(self, name, args, future):
+        try:
+            result = await getattr(self.flexitGo, name)(*args)
+            if not future.done():
+                future.set_result(result)
+
+        except Exception as e:
+            self.log.error("Exception in _write", error=e, name=name)
+            if not future.done():
+                future.set_result(False)
+
+    async def _writeLoop(self):
+        # allt som står i kön tas som en omgång, läget läses om direkt efteråt
+        while True:
+            batch = [await self.writes.get()]
+            while not self.writes.empty():
+                batch.append(self.writes.get_nowait())
+
+            try:
+                # lägesbyten är toggles och går i tur och ordning, övriga skickas samtidigt och slås ihop i setSensor
+                await asyncio.gather(*[self._write(*write) for write in batch if write[0] != "setPresetMode"])
+                for write in batch:
+                    if write[0] == "setPresetMode":
+                        await self._write(*write)
+                # setSensor har redan invaliderat det som skrevs, resten av cachen (t.ex. enhetsinfon) får ligga kvar
+                self.wake.set()
+
+            except asyncio.CancelledError:
+                for name, args, future in batch:
+                    if not future.done():
+                        future.cancel()
+                raise
+
+    async def _cached(self, request, name):
+        try:
+            await asyncio.wait_for(self.ready[name].wait(), self.pollInterval)
+        except asyncio.TimeoutError:
+            return web.Response(status=503, text="No data from FlexitGo yet")
+
+        body, etag, updated = self.cache[name]
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Last-Modified": time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(updated))}
+        if etag in (tag.strip() for tag in request.headers.get("If-None-Match", "").split(",")):
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body, content_type="application/json", charset="utf-8", headers=headers)
+
+    async def _sensors(self, request):
+        return await self._cached(request, "sensors")
+
+    async def _device(self, request):
+        return await self._cached(request, "device")
+
+    async def _health(self, request):
+        breaker = self.flexitGo.apiHandler.breaker
+        return web.json_response({"updated": {name: entry[2] for name, entry in self.cache.items()},
+                                  "circuit": breaker.state,
+                                  "pendingWrites": self.writes.qsize()}, dumps=ujson.dumps)
+
+    async def _set(self, request):
+        name = request.match_info["name"]
+        if name not in self.SETTERS:
+            return web.Response(status=404, text=f"Unknown setter {name}")
+
+        args = ()
+        if self.SETTERS[name]:
+            try:
+                args = (ujson.loads(await request.text())["value"],)
+            except (KeyError, ValueError, TypeError):
+                return web.Response(status=400, text='Expected {"value": ...}')
+
+        future = asyncio.get_running_loop().create_future()
+        await self.writes.put((name, args, future))
+        result = await future
+        return web.json_response({"result": result}, status=200 if result is not False else 502, dumps=ujson.dumps)
+
+    async def start(self, host="127.0.0.1", port=8080):
+        loop = asyncio.get_running_loop()
+        self.tasks = [loop.create_task(self._pollLoop()), loop.create_task(self._writeLoop())]
+        self.runner = web.AppRunner(self._app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.baseUrl = f"http://{host}:{port}"
+        self.log.info(f"FlexitGo server listening on {self.baseUrl}")
+        return self.baseUrl
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description="Serve cached FlexitGo state to local clients from one upstream session")
+    parser.add_argument("--username", default=os.environ.get("FLEXITGO_USERNAME"))
+    parser.add_argument("--password", default=os.environ.get("FLEXITGO_PASSWORD"))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--interval", type=float, default=FlexitGoServer.POLL_INTERVAL)
+    args = parser.parse_args()
+
+    async def main():
+        flexitGo = await FlexitGo.create(args.username, args.password)
+        server = FlexitGoServer(flexitGo, pollInterval=args.interval)
+        await server.start(args.host, args.port)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.stop()
+            await flexitGo.flushWrites()
+            await flexitGo.apiHandler.closeSession()
+
+    asyncio.run(main())